@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''This module contains an input/output manager that draws straight to the terminal with ANSI escape sequences.'''
+
+import os
+import select
+import sys
+import termios
+import tty
+from framebuffer import DISPLAY_WIDTH, DISPLAY_HEIGHT
+from iobase import BaseIOManager, DEFAULT_KEY_RELEASE_TIMEOUT, REWIND_INPUT, load_key_bindings
+
+
+REWIND_CHARACTERS = ('\x7f', '\x08')  # Backspace, which terminals send as either DEL or BS
+DEBUG_INFO_ROW = DISPLAY_HEIGHT // 2 + 2  # Terminal row, counting from 1
+
+# Glyph for every (top pixel, bottom pixel) pair, indexed by top << 1 | bottom
+_HALF_BLOCKS = (' ', '▄', '▀', '█')
+
+_ENTER_TERMINAL = '\x1b[?1049h\x1b[?25l\x1b[2J'  # Alternate screen, hidden cursor, cleared
+_LEAVE_TERMINAL = '\x1b[0m\x1b[?25h\x1b[?1049l'
+
+
+class ANSIIOManager(BaseIOManager):
+    '''Chip-8 machine input/output manager that writes ANSI escape sequences to the terminal itself.
+
+    Every terminal row shows two display rows with half-block glyphs, so the whole display takes 64x16
+    cells. The rows that changed since the last presented frame are built into a single string, which
+    is written with one system call per frame; nothing is written for frames that don't change the
+    display. Input is read from stdin in cbreak mode, with keys held the same way as in IOManager.
+
+    Parameters:
+    chip8: Chip8 instance this manager serves
+    show_debug_info: if True, the registers are printed under the display whenever they change
+    key_release_timeout: seconds a key stays held after the terminal last reported it
+
+    '''
+    def __init__(self, chip8, show_debug_info=True, key_release_timeout=DEFAULT_KEY_RELEASE_TIMEOUT):
+        # Virtual machine
+        super().__init__(chip8)
+
+        # Input setup
+        self.key_binding = load_key_bindings()
+        self.chip8.keypad.release_timeout = key_release_timeout
+        self._input_fd = sys.stdin.fileno()
+
+        # Video setup
+        self.show_debug_info = show_debug_info
+        self._output_fd = sys.stdout.fileno()
+        self._presented_rows = [0] * DISPLAY_HEIGHT  # What the terminal is currently showing
+        self._presented_debug_info = None
+
+    def run(self, main_loop):
+        '''Put the terminal in cbreak mode on the alternate screen, call main_loop and return its result.'''
+        saved_attributes = termios.tcgetattr(self._input_fd)
+        try:
+            tty.setcbreak(self._input_fd)
+            self._write(_ENTER_TERMINAL)
+            self._invalidate_presented_rows()
+
+            return main_loop()
+        finally:
+            termios.tcsetattr(self._input_fd, termios.TCSAFLUSH, saved_attributes)
+            self._write(_LEAVE_TERMINAL)
+
+    def present(self):
+        '''Write the changed rows and the debug info to the terminal in a single write.'''
+        output = []
+
+        if self.chip8.display.dirty:
+            self._draw_screen(output)
+            self.chip8.display.dirty = False
+
+        if self.show_debug_info:
+            self._draw_debug_info(output)
+
+        if output:
+            self._write(''.join(output))
+
+    def _read_input(self):
+        '''Drain every pending character on stdin, and return the keys they're bound to.'''
+        values = []
+
+        while select.select([self._input_fd], [], [], 0)[0]:
+            data = os.read(self._input_fd, 1024)
+            if not data:
+                break
+
+            for character in data.decode(errors='ignore'):
+                if character in REWIND_CHARACTERS:
+                    values.append(REWIND_INPUT)
+                elif character in self.key_binding:
+                    values.append(self.key_binding[character])
+
+        return values
+
+    def _invalidate_presented_rows(self):
+        '''Forget what the terminal is showing, debug info included, so that the next frame is drawn in full.'''
+        super()._invalidate_presented_rows()
+        self._presented_debug_info = None
+
+    def _draw_screen(self, output):
+        '''Append the escape sequences that redraw the changed span of every terminal row to output.'''
+        rows = self.chip8.display.rows
+        presented_rows = self._presented_rows
+
+        for coord_y in range(0, DISPLAY_HEIGHT, 2):
+            (top, bottom) = (rows[coord_y], rows[coord_y + 1])
+            changed_pixels = (top ^ presented_rows[coord_y]) | (bottom ^ presented_rows[coord_y + 1])
+            if not changed_pixels:
+                continue
+
+            # Only the span between the leftmost and the rightmost changed pixels is redrawn
+            first_x = DISPLAY_WIDTH - changed_pixels.bit_length()
+            last_x = DISPLAY_WIDTH - (changed_pixels & -changed_pixels).bit_length()
+            glyphs = ''.join(
+                _HALF_BLOCKS[(top >> pixel_bit & 1) << 1 | (bottom >> pixel_bit & 1)]
+                for pixel_bit in range(DISPLAY_WIDTH - 1 - first_x, DISPLAY_WIDTH - 2 - last_x, -1)
+            )
+            output.append(f'\x1b[{ coord_y // 2 + 1 };{ first_x + 1 }H{ glyphs }')
+
+            presented_rows[coord_y] = top
+            presented_rows[coord_y + 1] = bottom
+
+    def _draw_debug_info(self, output):
+        '''Append the escape sequences that print the CPU registers under the display to output, if they changed.'''
+        chip8 = self.chip8
+        debug_info = (f'PC: { chip8.reg_pc:03X}  I: { chip8.reg_i:03X}  DT: { chip8.delay_timer.get_value():3}  '
+                      f'V: { " ".join(f"{ value:02X}" for value in chip8.reg_v) }')
+
+        if debug_info != self._presented_debug_info:
+            output.append(f'\x1b[{ DEBUG_INFO_ROW };1H{ debug_info }\x1b[K')
+            self._presented_debug_info = debug_info
+
+    def _write(self, text):
+        '''Write text to the terminal, normally in a single system call.'''
+        data = text.encode()
+        while data:
+            data = data[os.write(self._output_fd, data):]
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+'''This module measures the throughput of the interpreter, the renderer and the decompiler.'''
+
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from compatibility import DEFAULT_ROM_DIRECTORY, find_roms
+from decompiler import decompile_instruction
+from headless import HeadlessIOManager
+from scheduler import Scheduler
+from vm import Chip8, ENGINES
+
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.10  # Slowdown that counts as a regression
+DEFAULT_REPEATS = 5
+ROM_KEY = 5
+# Frames the key is held, then released for, so that ROMs waiting on Fx0A keep seeing it go down and keep running
+ROM_KEY_TAP_FRAMES = 1
+
+# Synthetic programs, each an endless loop over one kind of instruction
+SYNTHETIC_PROGRAMS = {
+    'alu': [
+        0x6005,  # LD V0, 05
+        0x6107,  # LD V1, 07
+        0x8014,  # ADD V0, V1
+        0x8105,  # SUB V1, V0
+        0x8016,  # SHR V0, V1
+        0x8107,  # SUBN V1, V0
+        0x810E,  # SHL V1, V0
+        0x8011,  # OR V0, V1
+        0x8012,  # AND V0, V1
+        0x8013,  # XOR V0, V1
+        0x7003,  # ADD V0, 03
+        0x1204   # JP 204
+    ],
+    'draw': [
+        0xA000,  # LD I, 000 (the font)
+        0x6000,  # LD V0, 00
+        0x6100,  # LD V1, 00
+        0xD015,  # DRW V0, V1, 5
+        0x7003,  # ADD V0, 03
+        0x7101,  # ADD V1, 01
+        0x1206   # JP 206
+    ],
+    'memory': [
+        0xA300,  # LD I, 300
+        0xFF55,  # LD [I], VF
+        0xFF65,  # LD VF, [I]
+        0xF033,  # LD B, V0
+        0x7001,  # ADD V0, 01
+        0x1202   # JP 202
+    ]
+}
+
+
+def assemble(instructions):
+    '''Turn a list of 16-bit instructions into a Chip-8 binary.'''
+    return b''.join(instruction.to_bytes(2, 'big') for instruction in instructions)
+
+
+def best_time(function, repeats):
+    '''Call function the given number of times and return the shortest time it took.'''
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+
+    return min(times)
+
+
+def benchmark_synthetic(engine, repeats, cycles=200000):
+    '''Return the instructions per second of every synthetic program.'''
+    results = {}
+
+    for (name, instructions) in SYNTHETIC_PROGRAMS.items():
+        program = assemble(instructions)
+        results[f'synthetic.{ name }.{ engine }'] = cycles / best_time(lambda: Chip8(program, engine=engine).run(cycles), repeats)
+
+    return results
+
+
+def rom_key_script(frames):
+    '''Return a HeadlessIOManager key script tapping ROM_KEY over the given number of frames.'''
+    return {frame: [ROM_KEY] if frame // ROM_KEY_TAP_FRAMES % 2 == 0 else []
+            for frame in range(0, frames, ROM_KEY_TAP_FRAMES)}
+
+
+def benchmark_roms(engine, repeats, frames=60, clock_speed=600000):
+    '''Return the headless instructions per second of every bundled ROM, run unthrottled at a high clock speed.'''
+    results = {}
+    key_script = rom_key_script(frames)
+
+    for rom_path in find_roms([DEFAULT_ROM_DIRECTORY]):
+        with open(rom_path, 'rb') as rom_file:
+            program = rom_file.read()
+
+        def run_rom():
+            chip8 = Chip8(program, engine=engine, seed=0)
+            chip8.skip_idle_loops = False  # Skipped iterations would count as instructions without running any
+            HeadlessIOManager(chip8, key_script)
+            scheduler = Scheduler(chip8, clock_speed, throttle=False)
+            try:
+                scheduler.run(frames=frames)
+            except Exception:
+                pass  # Broken ROMs are still measured up to the point where they fail
+            run_rom.executed = scheduler.executed
+
+        elapsed_time = best_time(run_rom, repeats)
+        results[f'rom.{ os.path.basename(rom_path) }.{ engine }'] = run_rom.executed / elapsed_time
+
+    return results
+
+
+class _NullScreen:
+    '''Stand-in for an asciimatics screen that throws away everything printed to it.'''
+    def print_at(self, text, coord_x, coord_y, colour=7, attr=0, bg=0, transparent=False):
+        pass
+
+    def refresh(self):
+        pass
+
+
+def benchmark_renderer(repeats, frames=200):
+    '''Return the frames per second IOManager._draw_screen can copy, both in full and after a single sprite draw.'''
+    try:
+        from iomanager import IOManager
+    except ImportError:
+        return {}  # asciimatics isn't installed
+
+    chip8 = Chip8(b'')
+    io_manager = IOManager(chip8)
+    io_manager.screen = _NullScreen()
+    font = chip8.memory.read_data_from_addr(0, 80)
+    for coord_y in range(0, 32, 5):
+        for coord_x in range(0, 64, 8):
+            chip8.display.draw_sprite(font[coord_x:coord_x+5], coord_x, coord_y)
+
+    def draw_full_frames():
+        for _ in range(frames):
+            io_manager._invalidate_presented_rows()
+            io_manager._draw_screen()
+
+    def draw_sprite_frames():
+        for frame in range(frames):
+            chip8.display.draw_sprite(font[:5], frame % 64, frame % 32)
+            io_manager._draw_screen()
+
+    return {
+        'render.full_frame': frames / best_time(draw_full_frames, repeats),
+        'render.sprite_frame': frames / best_time(draw_sprite_frames, repeats)
+    }
+
+
+def benchmark_decompiler(repeats):
+    '''Return the instructions per second decompile_instruction can handle, over every word in the bundled ROMs.'''
+    instructions = []
+    for rom_path in find_roms([DEFAULT_ROM_DIRECTORY]):
+        with open(rom_path, 'rb') as rom_file:
+            program = rom_file.read()
+        instructions += [program[addr:addr+2].hex().upper() for addr in range(0, len(program) - 1, 2)]
+
+    decodable_instructions = []
+    for instruction in instructions:
+        try:
+            decompile_instruction(instruction)
+            decodable_instructions.append(instruction)
+        except Exception:
+            pass  # Sprite data
+
+    def decompile_all():
+        for instruction in decodable_instructions:
+            decompile_instruction(instruction)
+
+    return {'decompiler.decompile_instruction': len(decodable_instructions) / best_time(decompile_all, repeats)}
+
+
+def run_benchmarks(repeats):
+    '''Run every benchmark and return a dict mapping their names to operations per second.'''
+    results = {}
+
+    for engine in ENGINES:
+        results.update(benchmark_synthetic(engine, repeats))
+        results.update(benchmark_roms(engine, repeats))
+    results.update(benchmark_renderer(repeats))
+    results.update(benchmark_decompiler(repeats))
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    '''Print every result next to its baseline and return the names of the ones that regressed.'''
+    regressions = []
+
+    print(f'{ "Benchmark":<40} { "ops/s":>14} { "baseline":>14} { "change":>8}')
+    for (name, value) in results.items():
+        if name not in baseline:
+            print(f'{ name:<40} { value:>14.0f} { "-":>14} { "-":>8}')
+            continue
+
+        change = value / baseline[name] - 1
+        marker = ''
+        if change < -threshold:
+            regressions.append(name)
+            marker = '  REGRESSION'
+        print(f'{ name:<40} { value:>14.0f} { baseline[name]:>14.0f} { change:>+8.1%}{ marker }')
+
+    return regressions
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Measure the emulator\'s throughput and compare it against a baseline.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE,
+                        help='baseline file to compare against (default benchmark_baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'slowdown that counts as a regression (default { DEFAULT_THRESHOLD })')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help=f'times every benchmark is run, keeping the best (default { DEFAULT_REPEATS })')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGUMENTS = parse_arguments()
+    RESULTS = run_benchmarks(ARGUMENTS.repeats)
+
+    BASELINE = {}
+    if os.path.exists(ARGUMENTS.baseline):
+        with open(ARGUMENTS.baseline) as BASELINE_FILE:
+            BASELINE = json.load(BASELINE_FILE)
+
+    REGRESSIONS = compare_results(RESULTS, BASELINE, ARGUMENTS.threshold)
+
+    if ARGUMENTS.save_baseline:
+        with open(ARGUMENTS.baseline, 'w') as BASELINE_FILE:
+            json.dump(RESULTS, BASELINE_FILE, indent=4)
+        print(f'Saved the results as the baseline in { ARGUMENTS.baseline }')
+
+    if REGRESSIONS:
+        print(f'{ len(REGRESSIONS) } benchmarks regressed by more than { ARGUMENTS.threshold:.0%}')
+        sys.exit(1)
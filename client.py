@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''This module contains a client for the Chip-8 session server, and a load test built on it.'''
+
+import asyncio
+import json
+from argparse import ArgumentParser
+from framebuffer import DISPLAY_HEIGHT
+from server import DEFAULT_HOST, DEFAULT_PORT, encode_message
+
+
+class Client:
+    '''Connection to a Chip-8 session server, which keeps a copy of the display of every attached session.
+
+    Use connect to open one. Replies are matched to the commands that asked for them, while frame
+    messages are applied to displays as they arrive.
+
+    Parameters:
+    reader: asyncio stream reader of the connection
+    writer: asyncio stream writer of the connection
+
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+        self.displays = {}  # Session IDs, mapped to display rows
+        self.frames_received = {}  # Session IDs, mapped to the number of frame messages received
+        self.closed_sessions = {}  # Session IDs, mapped to the error that closed them, if any
+
+        self._next_request = 1
+        self._pending_replies = {}  # Request IDs, mapped to the futures waiting for their replies
+        self._read_task = asyncio.ensure_future(self._read_messages())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        '''Connect to a server on TCP, or on a Unix socket if unix_path is given.'''
+        if unix_path is not None:
+            (reader, writer) = await asyncio.open_unix_connection(unix_path)
+        else:
+            (reader, writer) = await asyncio.open_connection(host, port)
+
+        return cls(reader, writer)
+
+    async def request(self, command, **fields):
+        '''Send a command and return the reply, raising an Exception if the server reports an error.'''
+        if self._read_task.done():
+            raise ConnectionError('No longer reading from the server.')  # So the reply would never arrive
+
+        request = self._next_request
+        self._next_request += 1
+
+        reply = asyncio.get_running_loop().create_future()
+        self._pending_replies[request] = reply
+        self.writer.write(encode_message({'command': command, 'request': request, **fields}))
+        await self.writer.drain()
+
+        message = await reply
+        if message['event'] == 'error':
+            raise Exception(message['message'])
+
+        return message
+
+    async def create_session(self, rom=None, program=None, engine='interpreter', clock_speed=None):
+        '''Start a session from a ROM file under the ROM folder of the server or from a Chip-8 binary, and return its ID.'''
+        fields = {'engine': engine}
+        if rom is not None:
+            fields['rom'] = rom
+        else:
+            fields['program'] = program.hex()
+        if clock_speed is not None:
+            fields['clock'] = clock_speed
+
+        session_id = (await self.request('create', **fields))['session']
+        self.displays.setdefault(session_id, [0] * DISPLAY_HEIGHT)
+        self.frames_received.setdefault(session_id, 0)
+
+        return session_id
+
+    async def attach(self, session_id):
+        '''Start getting the frames of a session.'''
+        self.displays.setdefault(session_id, [0] * DISPLAY_HEIGHT)
+        self.frames_received.setdefault(session_id, 0)
+        await self.request('attach', session=session_id)
+
+    async def press_key(self, session_id, key):
+        '''Hold down a key of a session.'''
+        await self.request('key', session=session_id, key=key, pressed=True)
+
+    async def release_key(self, session_id, key):
+        '''Release a key of a session.'''
+        await self.request('key', session=session_id, key=key, pressed=False)
+
+    async def stats(self):
+        '''Return the frame rates reported by the server.'''
+        return await self.request('stats')
+
+    async def close(self):
+        '''Disconnect, which also closes every session this client created.'''
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._read_task.cancel()
+
+    async def _read_messages(self):
+        '''Apply frame messages and hand replies to the commands waiting for them, until disconnected.'''
+        error = ConnectionError('Disconnected from the server.')
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+
+                message = json.loads(line)
+                if message['event'] == 'frame':
+                    # The first frame of a new session can arrive in the same read as the reply creating it
+                    rows = self.displays.setdefault(message['session'], [0] * DISPLAY_HEIGHT)
+                    for (coord_y, row) in message['rows'].items():
+                        rows[int(coord_y)] = int(row, 16)
+                    self.frames_received[message['session']] = self.frames_received.get(message['session'], 0) + 1
+                elif message['event'] == 'closed':
+                    self.closed_sessions[message['session']] = message['error']
+                elif message.get('request') in self._pending_replies:
+                    self._pending_replies.pop(message['request']).set_result(message)
+        except Exception as read_error:
+            error = read_error  # Handed to the commands waiting for replies, which would otherwise wait forever
+        finally:
+            for reply in self._pending_replies.values():
+                if not reply.done():
+                    reply.set_exception(error)
+            self._pending_replies.clear()
+
+
+async def load_test(rom, sessions, seconds, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None,
+                    engine='interpreter', clock_speed=None):
+    '''Run a ROM in the given number of sessions for a while, each over its own connection, and return the server stats.'''
+    clients = [await Client.connect(host, port, unix_path) for _ in range(sessions)]
+    try:
+        for client in clients:
+            await client.create_session(rom=rom, engine=engine, clock_speed=clock_speed)
+
+        await asyncio.sleep(seconds)
+        stats = await clients[0].stats()
+        stats['frames_received'] = sum(sum(client.frames_received.values()) for client in clients)
+    finally:
+        for client in clients:
+            await client.close()
+
+    return stats
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Load test a Chip-8 session server with a ROM.')
+    parser.add_argument('rom', help='Chip-8 ROM file, relative to the ROM folder of the server')
+    parser.add_argument('--sessions', type=int, default=8, help='sessions to run at once (default 8)')
+    parser.add_argument('--seconds', type=float, default=5, help='seconds to run them for (default 5)')
+    parser.add_argument('--engine', default='interpreter', help='execution engine the sessions use')
+    parser.add_argument('--clock', type=int, help='emulated instructions per second of every session')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'server address (default { DEFAULT_HOST })')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'server TCP port (default { DEFAULT_PORT })')
+    parser.add_argument('--unix', metavar='PATH', help='connect to a Unix socket at PATH instead of TCP')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGUMENTS = parse_arguments()
+    STATS = asyncio.run(load_test(ARGUMENTS.rom, ARGUMENTS.sessions, ARGUMENTS.seconds, ARGUMENTS.host,
+                                  ARGUMENTS.port, ARGUMENTS.unix, ARGUMENTS.engine, ARGUMENTS.clock))
+
+    for (SESSION_ID, SESSION) in STATS['sessions'].items():
+        print(f'Session { SESSION_ID }: { SESSION["frame_rate"]:.1f} frames/s, { SESSION["frames"] } frames, '
+              f'{ SESSION["instructions"] } instructions')
+    print(f'Loop: { STATS["frame_rate"]:.1f} frames/s, { STATS["frame_host_ms"]:.2f} ms of host time per frame')
+    print(f'Aggregate: { STATS["aggregate_frame_rate"]:.1f} session frames/s, { STATS["frames_received"] } frame messages received')
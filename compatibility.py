@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+'''This module runs every ROM in a set of folders headless and reports how well each one works.'''
+
+import hashlib
+import json
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from frameexport import FrameExporter, EXPORT_FORMATS
+from scheduler import Scheduler
+from vm import Chip8, ENGINES, UnknownInstructionError
+
+
+DEFAULT_ROM_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs')
+DEFAULT_FRAMES = 600  # 10 seconds of emulated time
+
+
+def find_roms(paths):
+    '''Return every file in the given files and folders, searching folders recursively.'''
+    roms = []
+
+    for path in paths:
+        if os.path.isfile(path):
+            roms.append(path)
+            continue
+
+        for (directory, _, file_names) in os.walk(path):
+            roms += [os.path.join(directory, file_name) for file_name in file_names]
+
+    return sorted(roms)
+
+
+def check_rom(rom_path, frames=DEFAULT_FRAMES, engine='interpreter', export_directory=None, export_format='png',
+              cycles=None):
+    '''
+    Run a ROM headless for the given number of frames, or of instructions if cycles is given,
+    and return a dict describing how it went.
+    If export_directory is given, its frames are exported to a folder or a y4m file named after the ROM,
+    under a folder named after its category.
+    '''
+    result = {
+        'rom': os.path.basename(rom_path),
+        'category': os.path.basename(os.path.dirname(rom_path)),
+        'status': 'ok',
+        'error': None,
+        'instruction': None,
+        'pc': None
+    }
+
+    try:
+        with open(rom_path, 'rb') as rom_file:
+            chip8 = Chip8(rom_file.read(), engine=engine, seed=0)  # Seeded, so that framebuffer hashes are repeatable
+    except Exception as error:
+        # Any file in a ROM folder is checked, so one that doesn't even load is reported instead of ending the run
+        result['status'] = 'crashed'
+        result['error'] = f'{ type(error).__name__ }: { error }'
+        result['frames'] = 0
+        result['instructions'] = 0
+        result['skipped_instructions'] = 0
+        result['instructions_per_second'] = None
+        result['framebuffer_hash'] = None
+        return result
+    scheduler = Scheduler(chip8, throttle=False)
+
+    exporter = None
+    if export_directory is not None:
+        export_path = os.path.join(export_directory, os.path.basename(os.path.dirname(rom_path)), os.path.basename(rom_path))
+        if export_format == 'y4m':
+            os.makedirs(os.path.dirname(export_path), exist_ok=True)
+            export_path += '.y4m'
+        exporter = FrameExporter(chip8, export_path, export_format)
+        scheduler.add_frame_listener(exporter.record)
+
+    start_time = time.perf_counter()
+    try:
+        if cycles is None:
+            scheduler.run(frames=frames)
+        else:
+            scheduler.run(cycles=cycles)
+    except UnknownInstructionError as error:
+        result['status'] = 'unknown instruction'
+        result['error'] = str(error)
+        result['instruction'] = f'{ chip8.memory.read_word_from_addr(chip8.reg_pc):04X}'
+        result['pc'] = f'{ chip8.reg_pc:03X}'
+    except Exception as error:
+        result['status'] = 'crashed'
+        result['error'] = f'{ type(error).__name__ }: { error }'
+        result['pc'] = f'{ chip8.reg_pc:03X}'
+    elapsed_time = time.perf_counter() - start_time
+
+    if exporter is not None:
+        exporter.close()
+
+    if result['status'] == 'ok' and chip8.is_halted():
+        result['status'] = 'waiting for key'  # Nothing is pressed headless, so this is as far as it gets
+
+    result['frames'] = scheduler.frame
+    # Skipped idle loop iterations are reported apart, so that they don't inflate the throughput
+    run_instructions = scheduler.executed - scheduler.skipped
+    result['instructions'] = run_instructions
+    result['skipped_instructions'] = scheduler.skipped
+    result['instructions_per_second'] = round(run_instructions / elapsed_time) if elapsed_time else None
+    result['framebuffer_hash'] = hashlib.sha1(bytes(chip8.display)).hexdigest()
+
+    return result
+
+
+def check_roms(rom_paths, frames=DEFAULT_FRAMES, engine='interpreter', workers=None, export_directory=None,
+               export_format='png', cycles=None):
+    '''Check every ROM in parallel, one per process, and return the results in the same order.'''
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(check_rom, rom_path, frames, engine, export_directory, export_format, cycles)
+                   for rom_path in rom_paths]
+        return [future.result() for future in futures]
+
+
+def format_markdown_report(results):
+    '''Return the results as a Markdown table.'''
+    lines = [
+        '| Category | ROM | Status | Frames | Instructions/s | Framebuffer hash | Error |',
+        '| --- | --- | --- | ---: | ---: | --- | --- |'
+    ]
+
+    for result in results:
+        error = result['error'] or ''
+        if result['pc'] is not None:
+            error += f' (PC { result["pc"] }'
+            error += f', instruction { result["instruction"] })' if result['instruction'] else ')'
+
+        framebuffer_hash = f'`{ result["framebuffer_hash"][:12] }`' if result['framebuffer_hash'] else ''
+        lines.append(f'| { result["category"] } | { result["rom"] } | { result["status"] } | { result["frames"] } '
+                     f'| { result["instructions_per_second"] } | { framebuffer_hash } | { error.strip() } |')
+
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Run Chip-8 ROMs headless and report how well they work.')
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_ROM_DIRECTORY],
+                        help='ROM files or folders to search for them (default: the bundled programs)')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES,
+                        help=f'frames to run every ROM for (default { DEFAULT_FRAMES })')
+    parser.add_argument('--cycles', type=int,
+                        help='instructions to run every ROM for instead, or until it waits for a key forever')
+    parser.add_argument('--engine', choices=ENGINES, default='interpreter', help='execution engine to use')
+    parser.add_argument('--workers', type=int, help='processes to use (default: one per core)')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE as JSON')
+    parser.add_argument('--export', metavar='DIR', help='also export the frames of every ROM under DIR')
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS, default='png',
+                        help='format to export frames in (default png)')
+    parser.add_argument('--markdown', metavar='FILE', help='write the Markdown report to FILE instead of printing it')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGUMENTS = parse_arguments()
+
+    START_TIME = time.perf_counter()
+    RESULTS = check_roms(find_roms(ARGUMENTS.paths), ARGUMENTS.frames, ARGUMENTS.engine, ARGUMENTS.workers,
+                         ARGUMENTS.export, ARGUMENTS.export_format, ARGUMENTS.cycles)
+    ELAPSED_TIME = time.perf_counter() - START_TIME
+
+    if ARGUMENTS.json:
+        with open(ARGUMENTS.json, 'w') as JSON_FILE:
+            json.dump(RESULTS, JSON_FILE, indent=4)
+
+    REPORT = format_markdown_report(RESULTS)
+    if ARGUMENTS.markdown:
+        with open(ARGUMENTS.markdown, 'w') as MARKDOWN_FILE:
+            MARKDOWN_FILE.write(REPORT + '\n')
+    else:
+        print(REPORT)
+
+    print(f'Checked { len(RESULTS) } ROMs in { ELAPSED_TIME:.2f} seconds')
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+'''This module contains the Debugger class, which stops a Chip-8 machine on breakpoints, watchpoints and register conditions.'''
+
+import operator
+import queue
+import sys
+import threading
+from memorybuffer import MEMORY_SIZE
+from vm import ExecutionHalted, IdleLoop, install_step_hook, remove_step_hook
+
+
+CONDITION_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+REGISTER_NAMES = tuple(f'v{ x:x}' for x in range(16)) + ('i', 'pc', 'sp', 'dt', 'st')
+
+HELP = '''Commands:
+  break ADDR              stop before the instruction at ADDR runs
+  delete ADDR             remove the breakpoint at ADDR
+  watch ADDR [LENGTH]     stop after an instruction writes to any of the LENGTH bytes at ADDR
+  unwatch ADDR            remove the watchpoint at ADDR
+  condition REG OP VALUE  stop when a register comparison becomes true, e.g. condition v3 >= 0x10
+  uncondition N           remove condition number N
+  list                    show every breakpoint, watchpoint and condition
+  step [N]                run N instructions, 1 by default
+  next                    like step, but runs a whole subroutine when stopped on a CALL
+  continue                resume running
+  pause                   stop running
+  registers               show the registers
+  memory ADDR [LENGTH]    show LENGTH bytes of memory at ADDR, 16 by default
+  quit                    exit the emulator
+Registers are v0 to vf, i, pc, sp, dt and st. Numbers are decimal, or hex with 0x.'''
+
+
+def parse_number(text):
+    '''Parse a decimal or 0x-prefixed hexadecimal number.'''
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise Exception(f'{ text } is not a number.')
+
+
+def read_register(chip8, register):
+    '''Return the value of a register named v0 to vf, i, pc, sp, dt or st.'''
+    if register not in REGISTER_NAMES:
+        raise Exception(f'Unknown register { register }.')
+    if register[0] == 'v':
+        return chip8.reg_v[int(register[1], 16)]
+
+    return {
+        'i': lambda: chip8.reg_i,
+        'pc': lambda: chip8.reg_pc,
+        'sp': lambda: chip8.reg_sp,
+        'dt': chip8.delay_timer.get_value,
+        'st': chip8.sound_timer.get_value
+    }[register]()
+
+
+class Debugger:
+    '''Stops a machine before breakpoints, after writes to watched memory and when register conditions become true.
+
+    While any of those are set, the machine's step function is replaced by a checking one and every
+    engine runs through it one instruction at a time, as with the Profiler. Once they're all removed the
+    original functions are put back, so a debugger with nothing set costs nothing. Watched writes are
+    caught by a memory write listener that only exists while there are watchpoints.
+
+    Stopping pauses the machine, so the scheduler skips its frames, timers included, until it's resumed.
+    Commands come as text lines, either through execute or from a stream given to listen, and are
+    answered with text. Once the stream given to listen ends, stopping quits, since nothing could resume
+    the machine. Skipped idle loop iterations run no instructions, so they can't be stopped in.
+
+    Parameters:
+    chip8: Chip8 instance to debug
+
+    '''
+    def __init__(self, chip8):
+        self.chip8 = chip8
+        self.enabled = False
+
+        self.breakpoints = set()
+        self.watchpoints = {}  # Start addresses, mapped to lengths
+        self.conditions = []  # [text, register, comparison, value, whether it held after the last instruction]
+
+        self._watched = bytearray(MEMORY_SIZE)  # 1 for every watched byte
+        self._watch_hits = []  # (addr, n_bytes) writes to watched bytes since the last instruction started
+        self._step_over = None  # (PC, SP) that ends a step over a subroutine
+        self._stop_reason = None  # Set when the machine has to stop before the next instruction
+        self._resume_addr = None  # Address resumed from, whose breakpoint is ignored once
+
+        self.output_stream = None
+        self._commands = None
+        self._input_closed = False  # Set once every command listened for has been read
+
+    # Commands
+    def execute(self, command_line):
+        '''Run a command line and return its text output.'''
+        words = command_line.split()
+        if not words:
+            return ''
+
+        (command, arguments) = (words[0].lower(), words[1:])
+        handler = getattr(self, f'_command_{ command }', None)
+        if handler is None:
+            return f'Unknown command { command }, try help.'
+
+        try:
+            return handler(*arguments)
+        except TypeError:
+            return f'Wrong number of arguments for { command }, try help.'
+        except Exception as error:
+            return str(error)
+
+    def listen(self, input_stream=None, output_stream=None):
+        '''
+        Read commands from a text stream, stdin by default, and write their output to another one, stdout by default.
+        The commands are read by a thread of their own and run at the start of every frame, paused or not.
+        '''
+        self.output_stream = output_stream or sys.stdout
+        self._commands = queue.Queue()
+        threading.Thread(target=self._read_commands, args=(input_stream or sys.stdin,), daemon=True).start()
+
+        # The IOManager is polled every frame, even while the machine is paused
+        io_manager = self.chip8.io_manager
+        poll_input = io_manager.poll_input
+
+        def poll_input_and_commands():
+            self.process_commands()
+            poll_input()
+
+        io_manager.poll_input = poll_input_and_commands
+
+        # Commands keep coming until the end of the stream, so the run doesn't end before then
+        has_pending_input = io_manager.has_pending_input
+        io_manager.has_pending_input = lambda: not self._input_closed or has_pending_input()
+
+    def process_commands(self):
+        '''Run every command received by listen so far, and quit if the machine is paused with no more to come.'''
+        while True:
+            try:
+                command_line = self._commands.get_nowait()
+            except queue.Empty:
+                break
+
+            if command_line is None:  # End of the input
+                self._input_closed = True
+            else:
+                self._write(self.execute(command_line))
+
+        if self._input_closed and self.chip8.paused:
+            self._command_quit()
+
+    def pause(self):
+        '''Stop the machine before its next instruction.'''
+        self.chip8.paused = True
+
+    def resume(self):
+        '''Let the machine run again, without stopping on the breakpoint it's stopped on.'''
+        self._stop_reason = None
+        self._resume_addr = self.chip8.reg_pc
+        self.chip8.paused = False
+
+    def format_registers(self):
+        '''Return the registers as a line of text.'''
+        chip8 = self.chip8
+        return (f'PC: { chip8.reg_pc:03X}  I: { chip8.reg_i:03X}  SP: { chip8.reg_sp }  '
+                f'DT: { chip8.delay_timer.get_value() }  ST: { chip8.sound_timer.get_value() }  '
+                f'V: { " ".join(f"{ value:02X}" for value in chip8.reg_v) }')
+
+    def _command_help(self):
+        return HELP
+
+    def _command_break(self, addr):
+        addr = parse_number(addr)
+        self.breakpoints.add(addr)
+        self._update_enabled()
+        return f'Breakpoint at { addr:03X}'
+
+    def _command_delete(self, addr):
+        addr = parse_number(addr)
+        if addr not in self.breakpoints:
+            return f'No breakpoint at { addr:03X}'
+
+        self.breakpoints.remove(addr)
+        self._update_enabled()
+        return f'Deleted the breakpoint at { addr:03X}'
+
+    def _command_watch(self, addr, length='1'):
+        (addr, length) = (parse_number(addr), parse_number(length))
+        if not 0 <= addr < addr + length <= MEMORY_SIZE:
+            raise Exception('Watchpoints have to fit in memory.')
+
+        self.watchpoints[addr] = length
+        self._update_watched()
+        return f'Watching { length } bytes at { addr:03X}'
+
+    def _command_unwatch(self, addr):
+        addr = parse_number(addr)
+        if self.watchpoints.pop(addr, None) is None:
+            return f'No watchpoint at { addr:03X}'
+
+        self._update_watched()
+        return f'Stopped watching { addr:03X}'
+
+    def _command_condition(self, register, comparison, value):
+        register = register.lower()
+        if register not in REGISTER_NAMES:
+            raise Exception(f'Unknown register { register }.')
+        if comparison not in CONDITION_OPERATORS:
+            raise Exception(f'Unknown comparison { comparison }.')
+
+        condition = [f'{ register } { comparison } { value }', register, CONDITION_OPERATORS[comparison],
+                     parse_number(value), False]
+        condition[4] = self._condition_holds(condition)
+        self.conditions.append(condition)
+        self._update_enabled()
+        return f'Condition { len(self.conditions) }: { condition[0] }'
+
+    def _command_uncondition(self, number):
+        number = parse_number(number)
+        if not 1 <= number <= len(self.conditions):
+            return f'No condition { number }'
+
+        condition = self.conditions.pop(number - 1)
+        self._update_enabled()
+        return f'Removed condition { number }: { condition[0] }'
+
+    def _command_list(self):
+        lines = [f'Breakpoint at { addr:03X}' for addr in sorted(self.breakpoints)]
+        lines += [f'Watchpoint at { addr:03X}, { length } bytes' for (addr, length) in sorted(self.watchpoints.items())]
+        lines += [f'Condition { number }: { condition[0] }' for (number, condition) in enumerate(self.conditions, 1)]
+
+        return '\n'.join(lines) or 'Nothing set'
+
+    def _command_step(self, count='1'):
+        self.pause()
+        self._stop_reason = None
+
+        for _ in range(parse_number(count)):
+            try:
+                type(self.chip8).step(self.chip8)  # The machine's own step, without stopping on anything
+            except ExecutionHalted:
+                return f'Waiting for a key\n{ self._format_stop() }'
+            except IdleLoop:
+                pass  # The jump closing an idle loop has already run, without skipping anything
+
+        # Stepping can't be stopped, so the watchpoints and conditions it set off are only brought up to date
+        self._watch_hits.clear()
+        for condition in self.conditions:
+            condition[4] = self._condition_holds(condition)
+
+        return self._format_stop()
+
+    def _command_next(self):
+        chip8 = self.chip8
+        if chip8.memory.read_word_from_addr(chip8.reg_pc) >> 12 != 0x2:
+            return self._command_step()
+
+        # The subroutine returns to the instruction after the CALL, with the stack as deep as it is now
+        self._step_over = (chip8.reg_pc + 2, chip8.reg_sp)
+        self._update_enabled()
+        self.resume()
+        return 'Running to the end of the subroutine'
+
+    def _command_continue(self):
+        self.resume()
+        return 'Running'
+
+    def _command_pause(self):
+        self.pause()
+        return self._format_stop()
+
+    def _command_registers(self):
+        return self.format_registers()
+
+    def _command_memory(self, addr, length='16'):
+        (addr, length) = (parse_number(addr), parse_number(length))
+        memory = self.chip8.memory.read_data_from_addr(addr, min(length, MEMORY_SIZE - addr))
+
+        return '\n'.join(f'{ addr + offset:03X}: { memory[offset:offset+16].hex(" ").upper() }'
+                         for offset in range(0, len(memory), 16))
+
+    def _command_quit(self):
+        raise SystemExit(0)
+
+    # Breaking
+    def _update_enabled(self):
+        '''Swap the checking step function in while anything can stop the machine, and out once nothing can.'''
+        needed = bool(self.breakpoints or self.watchpoints or self.conditions or self._step_over)
+
+        if needed and not self.enabled:
+            install_step_hook(self.chip8, self)
+            self.enabled = True
+        elif not needed and self.enabled:
+            remove_step_hook(self.chip8, self)
+            self.enabled = False
+
+    def _update_watched(self):
+        '''Rebuild the watched byte mask, and add or remove the write listener as needed.'''
+        was_watching = any(self._watched)
+        self._watched = bytearray(MEMORY_SIZE)
+        for (addr, length) in self.watchpoints.items():
+            self._watched[addr:addr + length] = b'\x01' * length
+
+        if self.watchpoints and not was_watching:
+            self.chip8.memory.add_write_listener(self._check_write)
+        elif not self.watchpoints and was_watching:
+            self.chip8.memory.remove_write_listener(self._check_write)
+
+        self._update_enabled()
+
+    def _check_write(self, addr, n_bytes):
+        '''Memory write listener that remembers writes to watched bytes.'''
+        if any(self._watched[addr:addr + n_bytes]):
+            self._watch_hits.append((addr, n_bytes))
+
+    def _condition_holds(self, condition):
+        '''Return True if a condition holds for the current registers.'''
+        (_, register, comparison, value, _) = condition
+        return comparison(read_register(self.chip8, register), value)
+
+    def _step(self):
+        '''Replacement for Chip8.step that stops before breakpoints and after watched writes or conditions becoming true.'''
+        chip8 = self.chip8
+        addr = chip8.reg_pc
+
+        if self._stop_reason is None and addr != self._resume_addr:
+            if addr in self.breakpoints:
+                self._stop('breakpoint')
+            elif self._step_over == (addr, chip8.reg_sp):
+                self._stop('end of subroutine')
+        self._resume_addr = None
+
+        if self._stop_reason is not None:
+            raise ExecutionHalted()  # Ends the run with the PC on this instruction, which hasn't run
+
+        self._next_step()
+
+        if self._watch_hits:
+            writes = ', '.join(f'{ write_addr:03X}+{ n_bytes }' for (write_addr, n_bytes) in self._watch_hits)
+            self._watch_hits.clear()
+            self._stop(f'watchpoint, { addr:03X} wrote { writes }')
+
+        for (number, condition) in enumerate(self.conditions, 1):
+            held = condition[4]
+            condition[4] = self._condition_holds(condition)
+            if condition[4] and not held:
+                self._stop(f'condition { number }, { condition[0] }')
+
+    def _stop(self, reason):
+        '''Pause the machine before its next instruction and report why.'''
+        if self._stop_reason is None:
+            self._stop_reason = reason
+            self.pause()
+            self._write(f'Stopped on { reason }\n{ self._format_stop() }')
+
+        if self._step_over is not None:
+            self._step_over = None
+            self._update_enabled()
+
+    def _format_stop(self):
+        '''Return the registers and the instruction the machine is stopped on.'''
+        from decompiler import decompile_instruction  # Only needed while debugging
+        instruction = self.chip8.memory.read_word_from_addr(self.chip8.reg_pc)
+        try:
+            disassembly = decompile_instruction(instruction)
+        except Exception:
+            disassembly = '???'
+
+        return f'{ self.format_registers() }\n{ self.chip8.reg_pc:03X}: { instruction:04X}  { disassembly }'
+
+    # Command channel
+    def _read_commands(self, input_stream):
+        '''Command reader thread body, which queues every line read, then None at the end of the stream.'''
+        for command_line in input_stream:
+            self._commands.put(command_line)
+        self._commands.put(None)
+
+    def _write(self, text):
+        '''Write command output to the output stream, if listening.'''
+        if self.output_stream is not None and text:
+            self.output_stream.write(text + '\n')
+            self.output_stream.flush()
@@ -1,286 +1,365 @@
 #!/usr/bin/env python3
 '''This module decompiles any Chip-8 ROM file.'''
 
-from sys import argv
-
-
-def decompile_instruction(instruction):
-    return _instruction_category[instruction[0]](instruction[1:])
-
-
-def _instruction_0(arg):
-    '''Redirect to 0nnn [SYS addr], 00E0 [CLS] or 00EE [RET].'''
-    if arg == '0E0':
-        return _instruction_00E0()
-    elif arg == '0EE':
-        return _instruction_00EE()
-    else:
-        return _instruction_0nnn(arg)
-
-
-def _instruction_00E0():
-    '''Instruction 00E0 [CLS].'''
-    return 'CLS'
-
-
-def _instruction_00EE():
-    '''Instruction 00EE [RET].'''
-    return 'RET'
-
-
-def _instruction_0nnn(addr):
-    '''Instruction 0nnn [SYS addr].'''
-    return f'SYS { addr }'
-
-
-def _instruction_1(addr):
-    '''Instruction 1nnn [JP addr].'''
-    return f'JP { addr }'
-
-
-def _instruction_2(addr):
-    '''Instruction 2nnn [CALL addr].'''
-    return f'CALL { addr }'
-
-
-def _instruction_3(arg):
-    '''Instruction 3xkk [SE Vx, byte].'''
-    return f'SE V{ arg[0] }, { arg[1:] }'
-
-
-def _instruction_4(arg):
-    '''Instruction 4xkk [SNE Vx, byte].'''
-    return f'SNE V{ arg[0] }, { arg[1:] }'
-
-
-def _instruction_5(arg):
-    '''Instruction 5xy0 [SE Vx, Vy].'''
-    return f'SNE V{ arg[0] }, V{ arg[1] }'
-
-
-def _instruction_6(arg):
-    '''Instruction 6xkk [LD Vx, byte].'''
-    return f'LD V{ arg[0] }, { arg[1:] }'
-
-
-def _instruction_7(arg):
-    '''Instruction 7xkk [ADD Vx, byte].'''
-    return f'ADD V{ arg[0] }, { arg[1:] }'
-
-
-def _instruction_8(arg):
-    '''Redirect to 8xy[0-7] and 8xyE.'''
-    functions = {
-        '0': _instruction_8xy0,
-        '1': _instruction_8xy1,
-        '2': _instruction_8xy2,
-        '3': _instruction_8xy3,
-        '4': _instruction_8xy4,
-        '5': _instruction_8xy5,
-        '6': _instruction_8xy6,
-        '7': _instruction_8xy7,
-        'E': _instruction_8xyE
-    }
-
-    (x, y, instruction_nibble) = arg
-    return functions[instruction_nibble](x, y)
-
-
-def _instruction_8xy0(x, y):
-    '''Instruction 8xy0 [LD Vx, Vy].'''
-    return f'LD V{ x }, V{ y }'
-
-
-def _instruction_8xy1(x, y):
-    '''Instruction 8xy1 [OR Vx, Vy].'''
-    return f'OR V{ x }, V{ y }'
-
-
-def _instruction_8xy2(x, y):
-    '''Instruction 8xy2 [AND Vx, Vy].'''
-    return f'AND V{ x }, V{ y }'
-
-
-def _instruction_8xy3(x, y):
-    '''Instruction 8xy3 [XOR Vx, Vy].'''
-    return f'XOR V{ x }, V{ y }'
-
-
-def _instruction_8xy4(x, y):
-    '''Instruction 8xy4 [ADD Vx, Vy].'''
-    return f'ADD V{ x }, V{ y }'
-
-
-def _instruction_8xy5(x, y):
-    '''Instruction 8xy5 [SUB Vx, Vy].'''
-    return f'SUB V{ x }, V{ y }'
-
-
-def _instruction_8xy6(x, y):
-    '''Instruction 8xy6 [SHR Vx {, Vy}].'''
-    return f'SHR V{ x }, {{, V{ y }}}'
-
-
-def _instruction_8xy7(x, y):
-    '''Instruction 8xy7 [SUBN Vx, Vy].'''
-    return f'SNE V{ x }, V{ y }'
-
-
-def _instruction_8xyE(x, y):
-    '''Instruction 8xyE [SHL Vx {, Vy}].'''
-    return f'SNE V{ x }, {{, V{ y }}}'
-
-
-def _instruction_9(arg):
-    '''Instruction 9xy0 [SNE Vx, Vy].'''
-    return f'SNE V{ arg[0] }, V{ arg[1] }'
-
-
-def _instruction_A(arg):
-    '''Instruction Annn [LD I, addr].'''
-    return f'LD I, { arg }'
-
-
-def _instruction_B(arg):
-    '''Instruction Bnnn [JP V0, addr].'''
-    return f'JP V0, { addr }'
-
-
-def _instruction_C(arg):
-    '''Instruction Cxkk [RND Vx, byte].'''
-    return f'RND V{ arg[0] }, { arg[1:] }'
-
-
-def _instruction_D(arg):
-    '''Instruction Dxyn [DRW Vx, Vy, nibble].'''
-    return f'DRW V{ arg[0] }, V{ arg[1] }, { arg[2] }'
-
-
-def _instruction_E(arg):
-    '''Redirect to either [SKP Vx] or [SKNP Vx].'''
-    last_byte = arg[1:]
-
-    if last_byte == '9E':
-        return _instruction_Ex9E(arg[0])
-    elif last_byte == 'A1':
-        return _instruction_ExA1(arg[0])
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from memorybuffer import MEMORY_SIZE, PROGRAM_START
+
+
+DISASSEMBLER_VERSION = 2  # Bump whenever the output of disassemble changes, to invalidate cached results
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.disassembly_cache')
+
+
+def decode_instruction(instruction):
+    '''Return the mnemonic and the list of operands of a 16-bit instruction, or None if it isn't a Chip-8 instruction.'''
+    instruction_category = instruction >> 12
+    arg_nnn = instruction & 0x0FFF
+    arg_x = f'V{ (instruction >> 8) & 0xF:X}'
+    arg_y = f'V{ (instruction >> 4) & 0xF:X}'
+    arg_n = instruction & 0x000F
+    arg_kk = instruction & 0x00FF
+
+    if instruction_category == 0x0:
+        if instruction == 0x00E0:
+            return ('CLS', [])
+        elif instruction == 0x00EE:
+            return ('RET', [])
+        return ('SYS', [f'{ arg_nnn:03X}'])
+    elif instruction_category == 0x1:
+        return ('JP', [f'{ arg_nnn:03X}'])
+    elif instruction_category == 0x2:
+        return ('CALL', [f'{ arg_nnn:03X}'])
+    elif instruction_category == 0x3:
+        return ('SE', [arg_x, f'{ arg_kk:02X}'])
+    elif instruction_category == 0x4:
+        return ('SNE', [arg_x, f'{ arg_kk:02X}'])
+    elif instruction_category == 0x5:
+        return ('SE', [arg_x, arg_y])
+    elif instruction_category == 0x6:
+        return ('LD', [arg_x, f'{ arg_kk:02X}'])
+    elif instruction_category == 0x7:
+        return ('ADD', [arg_x, f'{ arg_kk:02X}'])
+    elif instruction_category == 0x8:
+        if arg_n not in _INSTRUCTION_8_MNEMONICS:
+            return None
+        return (_INSTRUCTION_8_MNEMONICS[arg_n], [arg_x, arg_y])
+    elif instruction_category == 0x9:
+        return ('SNE', [arg_x, arg_y])
+    elif instruction_category == 0xA:
+        return ('LD', ['I', f'{ arg_nnn:03X}'])
+    elif instruction_category == 0xB:
+        return ('JP', ['V0', f'{ arg_nnn:03X}'])
+    elif instruction_category == 0xC:
+        return ('RND', [arg_x, f'{ arg_kk:02X}'])
+    elif instruction_category == 0xD:
+        return ('DRW', [arg_x, arg_y, f'{ arg_n:X}'])
+    elif instruction_category == 0xE:
+        if arg_kk == 0x9E:
+            return ('SKP', [arg_x])
+        elif arg_kk == 0xA1:
+            return ('SKNP', [arg_x])
+        return None
     else:
-        raise Exception('ExXX instruction not recognised.')
-
-
-def _instruction_Ex9E(x):
-    '''Instruction Ex9E [SKP Vx].'''
-    return f'SKP V{ x }'
-
+        if arg_kk not in _INSTRUCTION_F_OPERANDS:
+            return None
+        return ('ADD' if arg_kk == 0x1E else 'LD', [operand or arg_x for operand in _INSTRUCTION_F_OPERANDS[arg_kk]])
+
+
+# Mnemonics of 8xyN, indexed by N
+_INSTRUCTION_8_MNEMONICS = {
+    0x0: 'LD',
+    0x1: 'OR',
+    0x2: 'AND',
+    0x3: 'XOR',
+    0x4: 'ADD',
+    0x5: 'SUB',
+    0x6: 'SHR',
+    0x7: 'SUBN',
+    0xE: 'SHL'
+}
 
-def _instruction_ExA1(x):
-    '''Instruction ExA1 [SKNP Vx].'''
-    return f'SKNP V{ x }'
+# Operands of FxKK, indexed by KK, with None standing for Vx
+_INSTRUCTION_F_OPERANDS = {
+    0x07: (None, 'DT'),
+    0x0A: (None, 'K'),
+    0x15: ('DT', None),
+    0x18: ('ST', None),
+    0x1E: ('I', None),
+    0x29: ('F', None),
+    0x33: ('B', None),
+    0x55: ('[I]', None),
+    0x65: (None, '[I]')
+}
 
 
-def _instruction_F(arg):
-    '''Redirect to all instructions starting with the F nibble.'''
-    functions = {
-        '07': _instruction_Fx07,
-        '0A': _instruction_Fx0A,
-        '15': _instruction_Fx15,
-        '18': _instruction_Fx18,
-        '1E': _instruction_Fx1E,
-        '29': _instruction_Fx29,
-        '33': _instruction_Fx33,
-        '55': _instruction_Fx55,
-        '65': _instruction_Fx65
+def decompile_instruction(instruction):
+    '''Return the assembly of an instruction, given either as an integer or as a string of 4 hex digits.'''
+    if isinstance(instruction, str):
+        instruction = int(instruction, 16)
+
+    decoded = decode_instruction(instruction)
+    if decoded is None:
+        raise Exception(f'Instruction { instruction:04X} not recognised.')
+
+    (mnemonic, operands) = decoded
+    return f'{ mnemonic } { ", ".join(operands) }'.rstrip()
+
+
+def disassemble(program, start=PROGRAM_START):
+    '''
+    Disassemble a ROM loaded at start, following every jump, call and skip from its first instruction.
+    Return a list with a dict for every instruction and every byte of data, in address order, with the keys
+    address, opcode (raw hex), kind ('code', 'sprite' or 'data'), label, mnemonic and operands.
+    An instruction or a labelled byte starting on the second byte of an instruction gets an entry of its own,
+    overlapping the one before.
+    '''
+    end = start + len(program)
+    code = {}  # Instructions reached, indexed by address
+    sprites = set()  # Addresses drawn by DRW
+    labels = {}
+
+    # Every path through the program is followed along with the value of I on it, when it's known
+    pending = [(start, None)]
+    visited = set()
+
+    while pending:
+        state = pending.pop()
+        if state in visited:
+            continue
+        visited.add(state)
+
+        (addr, reg_i) = state
+        if addr < start or addr + 1 >= end:
+            continue
+
+        offset = addr - start
+        instruction = program[offset] << 8 | program[offset + 1]
+        if addr not in code:
+            decoded = decode_instruction(instruction)
+            if decoded is None:
+                continue  # Data, reached through a skip over it or a computed jump
+            code[addr] = (instruction, decoded)
+
+        instruction_category = instruction >> 12
+        arg_nnn = instruction & 0x0FFF
+        arg_kk = instruction & 0x00FF
+
+        if instruction == 0x00EE:
+            continue
+        elif instruction_category == 0x1:
+            labels.setdefault(arg_nnn, f'loc_{ arg_nnn:03X}')
+            pending.append((arg_nnn, reg_i))
+            continue
+        elif instruction_category == 0x2:
+            labels[arg_nnn] = f'sub_{ arg_nnn:03X}'
+            pending.append((arg_nnn, reg_i))
+            reg_i = None  # The subroutine may have changed it
+        elif instruction_category == 0xB:
+            # Only the V0 = 0 target of a computed jump is known, usually the start of a jump table
+            labels.setdefault(arg_nnn, f'loc_{ arg_nnn:03X}')
+            pending.append((arg_nnn, None))
+            continue
+        elif instruction_category in (0x3, 0x4, 0x5, 0x9, 0xE):
+            pending.append((addr + 4, reg_i))
+        elif instruction_category == 0xA:
+            reg_i = arg_nnn
+        elif instruction_category == 0xD:
+            if reg_i is not None:
+                sprites.update(range(reg_i, reg_i + (instruction & 0x000F)))
+                labels.setdefault(reg_i, f'sprite_{ reg_i:03X}')
+        elif instruction_category == 0xF and arg_kk in (0x1E, 0x29):
+            reg_i = None
+
+        pending.append((addr + 2, reg_i))
+
+    entries = []
+    addr = start
+    while addr < end:
+        offset = addr - start
+
+        if addr in code:
+            (instruction, (mnemonic, operands)) = code[addr]
+            if mnemonic in ('SYS', 'JP', 'CALL') or instruction >> 12 == 0xA:
+                # Address operands are always last
+                operands = operands[:-1] + [labels.get(instruction & 0x0FFF, operands[-1])]
+            entries.append(_entry(addr, f'{ instruction:04X}', 'code', labels.get(addr), mnemonic, operands))
+            # Code reached at an odd offset into this instruction, or a label pointing there, isn't skipped
+            addr += 1 if addr + 1 in code or addr + 1 in labels else 2
+        else:
+            kind = 'sprite' if addr in sprites else 'data'
+            entries.append(_entry(addr, f'{ program[offset]:02X}', kind, labels.get(addr), 'DB', [f'{ program[offset]:02X}']))
+            addr += 1
+
+    return entries
+
+
+def _entry(address, opcode, kind, label, mnemonic, operands):
+    '''Build a disassembly entry.'''
+    return {
+        'address': address,
+        'opcode': opcode,
+        'kind': kind,
+        'label': label,
+        'mnemonic': mnemonic,
+        'operands': operands
     }
 
-    last_byte = arg[1:]
 
-    return functions[last_byte](arg[0])
+def format_listing(entries):
+    '''Return a disassembly as assembly text, with sprite data drawn as pixels.'''
+    lines = []
 
+    for entry in entries:
+        if entry['label'] is not None:
+            lines.append(f'{ entry["label"] }:')
 
-def _instruction_Fx07(x):
-    '''Instruction Fx07 [LD Vx, DT].'''
-    return f'LD V{ x }, DT'
+        line = f'{ entry["address"]:03X}: { entry["opcode"]:<4}  { entry["mnemonic"] } { ", ".join(entry["operands"]) }'
+        if entry['kind'] == 'sprite':
+            pixels = f'{ int(entry["opcode"], 16):08b}'.replace('0', '.').replace('1', '#')
+            line = f'{ line:<24}; { pixels }'
+        lines.append(line.rstrip())
 
+    return '\n'.join(lines)
 
-def _instruction_Fx0A(x):
-    '''Instruction Fx0A [LD Vx, K].'''
-    return f'LD V{ x }, K'
 
+class DisassemblyCache:
+    '''Disassembly of single instructions in a machine's memory, decoded once per address.
 
-def _instruction_Fx15(x):
-    '''Instruction Fx15 [LD DT, Vx].'''
-    return f'LD DT, V{ x }'
+    An address is forgotten whenever either of its bytes is written or restored, so the cache always matches
+    memory. generation counts the forgotten addresses, so that callers can tell when to redraw cached text.
 
+    Parameters:
+    memory: MemoryBuffer to disassemble
+
+    '''
+    def __init__(self, memory):
+        self.memory = memory
+        self.generation = 0
+
+        self._lines = [None] * MEMORY_SIZE  # Indexed by address
+        memory.add_write_listener(self._invalidate)
+        memory.add_restore_listener(self._invalidate)
+
+    def disassemble(self, addr):
+        '''Return the assembly of the instruction at addr, or a DW directive if it isn't one.'''
+        line = self._lines[addr]
+        if line is None:
+            instruction = self.memory.read_word_from_addr(addr)
+            decoded = decode_instruction(instruction)
+            if decoded is None:
+                line = f'DW { instruction:04X}'
+            else:
+                (mnemonic, operands) = decoded
+                line = f'{ mnemonic } { ", ".join(operands) }'.rstrip()
+            self._lines[addr] = line
 
-def _instruction_Fx18(x):
-    '''Instruction Fx18 [LD ST, Vx].'''
-    return f'LD ST, V{ x }'
+        return line
 
+    def _invalidate(self, addr, n_bytes):
+        '''Forget the instructions overlapping the n bytes written at addr.'''
+        # An instruction starting one byte before addr also has its second byte overwritten
+        for invalidated_addr in range(max(addr - 1, 0), addr + n_bytes):
+            if self._lines[invalidated_addr] is not None:
+                self._lines[invalidated_addr] = None
+                self.generation += 1
 
-def _instruction_Fx1E(x):
-    '''Instruction Fx1E [ADD I, Vx].'''
-    return f'ADD I, V{ x }'
 
+def disassemble_file(rom_path, cache_directory=DEFAULT_CACHE_DIRECTORY):
+    '''Disassemble a ROM file, reusing the cached result for a ROM with the same contents if there is one.'''
+    with open(rom_path, 'rb') as rom_file:
+        program = rom_file.read()
 
-def _instruction_Fx29(x):
-    '''Instruction Fx29 [LD F, Vx].'''
-    return f'LD F, V{ x }'
+    if cache_directory is None:
+        return disassemble(program)
 
+    cache_path = _cache_path(program, cache_directory)
+    entries = _load_cached(cache_path)
+    if entries is not None:
+        return entries
 
-def _instruction_Fx33(x):
-    '''Instruction Fx33 [LD B, Vx].'''
-    return f'LD B, V{ x }'
+    entries = disassemble(program)
 
+    # Written under a temporary name first, so that other processes never read a half written file
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary_path = f'{ cache_path }.{ os.getpid() }.tmp'
+    with open(temporary_path, 'w') as cache_file:
+        json.dump(entries, cache_file)
+    os.replace(temporary_path, cache_path)
 
-def _instruction_Fx55(x):
-    '''Instruction Fx55 [LD [I], Vx].'''
-    return f'LD [I], V{ x }'
+    return entries
 
 
-def _instruction_Fx65(x):
-    '''Instruction Fx65 [LD Vx, [I]].'''
-    return f'LD V{ x }, [I]'
+def disassemble_files(rom_paths, cache_directory=DEFAULT_CACHE_DIRECTORY, workers=None):
+    '''Disassemble every ROM file, in parallel for those not cached yet, and return the results in the same order.'''
+    results = [None] * len(rom_paths)
+    if cache_directory is not None:
+        for (index, rom_path) in enumerate(rom_paths):
+            with open(rom_path, 'rb') as rom_file:
+                results[index] = _load_cached(_cache_path(rom_file.read(), cache_directory))
 
-
-_instruction_category = {
-    '0': _instruction_0,
-    '1': _instruction_1,
-    '2': _instruction_2,
-    '3': _instruction_3,
-    '4': _instruction_4,
-    '5': _instruction_5,
-    '6': _instruction_6,
-    '7': _instruction_7,
-    '8': _instruction_8,
-    '9': _instruction_9,
-    'A': _instruction_A,
-    'B': _instruction_B,
-    'C': _instruction_C,
-    'D': _instruction_D,
-    'E': _instruction_E,
-    'F': _instruction_F
-}
+    missing = [index for (index, result) in enumerate(results) if result is None]
+    if len(missing) == 1:
+        results[missing[0]] = disassemble_file(rom_paths[missing[0]], cache_directory)  # Not worth starting a process for
+    elif missing:
+        from concurrent.futures import ProcessPoolExecutor  # Slow to import, and only needed for batches
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {index: executor.submit(disassemble_file, rom_paths[index], cache_directory) for index in missing}
+            for (index, future) in futures.items():
+                results[index] = future.result()
+
+    return results
+
+
+def _cache_path(program, cache_directory):
+    '''Path of the cache file for a ROM, named after a hash of its contents and the disassembler version.'''
+    rom_hash = hashlib.sha256(program).hexdigest()
+    return os.path.join(cache_directory, f'{ rom_hash }-v{ DISASSEMBLER_VERSION }.json')
+
+
+def _load_cached(cache_path):
+    '''Return the disassembly stored at cache_path, or None if there isn't a valid one.'''
+    try:
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None  # Not cached yet, or a damaged cache file that gets replaced
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    from compatibility import DEFAULT_ROM_DIRECTORY  # Imported here, since it loads the whole emulator
+    parser = ArgumentParser(description='Disassemble Chip-8 ROMs, separating their code from their data.')
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_ROM_DIRECTORY],
+                        help='ROM files or folders to search for them (default: the bundled programs)')
+    parser.add_argument('--json', action='store_true', help='print the disassembly as JSON instead of text')
+    parser.add_argument('--output', metavar='FILE', help='write the disassembly to FILE instead of printing it')
+    parser.add_argument('--workers', type=int, help='processes to use (default: one per core)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIRECTORY,
+                        help='folder disassemblies are cached in (default .disassembly_cache)')
+    parser.add_argument('--no-cache', action='store_true', help='disassemble every ROM again without the cache')
+
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    rom_file = open(argv[1], 'rb')
-
-    counter = 512
-
-    print(f'Instructions in the ROM file { argv[1] }:')
-    print('=' * 32)
-
-    while True:
-        read_word = rom_file.read(2).hex().upper()
+    from compatibility import find_roms
+    ARGUMENTS = parse_arguments()
 
-        if not read_word:
-            break
+    ROM_PATHS = find_roms(ARGUMENTS.paths)
+    RESULTS = disassemble_files(ROM_PATHS, None if ARGUMENTS.no_cache else ARGUMENTS.cache_dir, ARGUMENTS.workers)
 
-        try:
-            decompiled_instruction = decompile_instruction(read_word)
-        except:
-            decompiled_instruction = 'SPRITE???'
-
-        print('{0:03X}: {1:s}'.format(counter, decompiled_instruction))
-
-        counter += 2
+    if ARGUMENTS.json:
+        OUTPUT = json.dumps(dict(zip(ROM_PATHS, RESULTS)), indent=4)
+    else:
+        LISTINGS = []
+        for (ROM_PATH, ENTRIES) in zip(ROM_PATHS, RESULTS):
+            LISTINGS.append(f'Instructions in the ROM file { ROM_PATH }:\n{ "=" * 32 }\n{ format_listing(ENTRIES) }')
+        OUTPUT = '\n\n'.join(LISTINGS)
+
+    if ARGUMENTS.output:
+        with open(ARGUMENTS.output, 'w') as OUTPUT_FILE:
+            OUTPUT_FILE.write(OUTPUT + '\n')
+    else:
+        print(OUTPUT)
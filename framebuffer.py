@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''This module contains the FrameBuffer class.'''
+
+
+DISPLAY_WIDTH = 64
+DISPLAY_HEIGHT = 32
+ROW_MASK = (1 << DISPLAY_WIDTH) - 1
+
+
+class FrameBuffer:
+    '''Emulated Chip-8 display.
+
+    Every row is stored as a 64-bit integer, with the leftmost pixel in the most significant bit.
+    '''
+    def __init__(self):
+        self.rows = [0] * DISPLAY_HEIGHT
+        self.dirty = False  # Set whenever a pixel may have changed since the display was last presented
+
+    def __bytes__(self):
+        return b''.join(row.to_bytes(DISPLAY_WIDTH // 8, 'big') for row in self.rows)
+
+    def clear(self):
+        '''Turn off every pixel.'''
+        self.rows[:] = [0] * DISPLAY_HEIGHT
+        self.dirty = True
+
+    def draw_sprite(self, sprite, pos_x, pos_y):
+        '''
+        XOR the sprite, a sequence of 8-pixel rows, onto the display with its top left corner at the given coordinates.
+        Pixels that fall off the display wrap around to the other side.
+        Return 1 if any pixel that was on got turned off, 0 otherwise.
+        '''
+        rows = self.rows
+        pos_x %= DISPLAY_WIDTH
+        pos_y %= DISPLAY_HEIGHT
+        shift = DISPLAY_WIDTH - 8 - pos_x
+        collision = 0
+
+        for (row_number, sprite_row) in enumerate(sprite):
+            if shift >= 0:
+                sprite_bits = sprite_row << shift
+            else:  # The sprite row wraps around the right edge
+                sprite_bits = (sprite_row >> -shift) | ((sprite_row << (DISPLAY_WIDTH + shift)) & ROW_MASK)
+
+            coord_y = (pos_y + row_number) % DISPLAY_HEIGHT
+            collision |= rows[coord_y] & sprite_bits
+            rows[coord_y] ^= sprite_bits
+
+        self.dirty = True
+
+        return 1 if collision else 0
+
+    def get_pixel(self, coord_x, coord_y):
+        '''Return 1 if the pixel at the given coordinates is on, 0 otherwise.'''
+        return (self.rows[coord_y] >> (DISPLAY_WIDTH - 1 - coord_x)) & 1
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+'''This module streams the display of a Chip-8 machine to PBM or PNG image sequences and to raw y4m video.'''
+
+import os
+import queue
+import struct
+import threading
+import zlib
+from framebuffer import DISPLAY_WIDTH, DISPLAY_HEIGHT
+from scheduler import FRAME_RATE
+
+
+EXPORT_FORMATS = ('png', 'pbm', 'y4m')
+DEFAULT_EXPORT_SCALE = 4  # Image pixels per Chip-8 pixel, in each direction
+DEFAULT_QUEUE_SIZE = 256  # Frames, a little over 4 seconds of emulated time
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Luma of the 8 pixels in every packed byte, for y4m frames
+_BYTE_LUMAS = [bytes(255 if byte >> (7 - bit) & 1 else 0 for bit in range(8)) for byte in range(256)]
+
+
+def scale_rows(rows, scale):
+    '''Return the display rows as packed bytes, one per image row, with every pixel repeated scale times both ways.'''
+    scaled_rows = []
+
+    for row in rows:
+        if scale == 1:
+            packed_row = row.to_bytes(DISPLAY_WIDTH // 8, 'big')
+        else:
+            bits = ''.join(bit * scale for bit in f'{ row:0{ DISPLAY_WIDTH }b}')
+            packed_row = int(bits, 2).to_bytes(DISPLAY_WIDTH * scale // 8, 'big')
+        scaled_rows += [packed_row] * scale
+
+    return scaled_rows
+
+
+def encode_pbm(rows, scale=1):
+    '''Return the display rows as a binary PBM image, with lit pixels white.'''
+    header = f'P4\n{ DISPLAY_WIDTH * scale } { DISPLAY_HEIGHT * scale }\n'.encode()
+    # PBM bits are black when set, so every bit is flipped
+    return header + bytes(byte ^ 0xFF for byte in b''.join(scale_rows(rows, scale)))
+
+
+def encode_png(rows, scale=1):
+    '''Return the display rows as a 1-bit grayscale PNG image, with lit pixels white.'''
+    header = struct.pack('>IIBBBBB', DISPLAY_WIDTH * scale, DISPLAY_HEIGHT * scale, 1, 0, 0, 0, 0)
+    # Every scanline starts with its filter type, 0 for none
+    image_data = zlib.compress(b''.join(b'\x00' + row for row in scale_rows(rows, scale)), 9)
+
+    return PNG_SIGNATURE + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', image_data) + _png_chunk(b'IEND', b'')
+
+
+def encode_y4m_frame(rows, scale=1):
+    '''Return the display rows as a monochrome y4m frame, with lit pixels white.'''
+    return b'FRAME\n' + b''.join(b''.join(_BYTE_LUMAS[byte] for byte in row) for row in scale_rows(rows, scale))
+
+
+def y4m_header(scale=1):
+    '''Return the header of a monochrome y4m video of the display at the frame rate of the scheduler.'''
+    return f'YUV4MPEG2 W{ DISPLAY_WIDTH * scale } H{ DISPLAY_HEIGHT * scale } F{ FRAME_RATE }:1 Ip A1:1 Cmono\n'.encode()
+
+
+def _png_chunk(chunk_type, data):
+    '''Return a PNG chunk with its length and CRC.'''
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+class FrameExporter:
+    '''Streams the display at the end of every frame to image files or to a video file.
+
+    Add record as a frame listener of the scheduler running the machine. It only copies the display
+    rows into a bounded queue; encoding and writing happen on a writer thread, so a slow disk never
+    holds up the machine. Frames that find the queue full are dropped instead of waiting, and frames
+    identical to the last queued one are skipped. Image sequences are numbered by frame, so skipped
+    frames leave gaps. Videos repeat the last frame written over them, so they keep their timing.
+
+    Parameters:
+    chip8: Chip8 instance whose display is exported
+    path: folder to write numbered png or pbm images to, created if needed, or the y4m file to write
+    export_format: one of EXPORT_FORMATS
+    scale: image pixels per Chip-8 pixel, in each direction
+    queue_size: frames that can wait for the writer thread before new ones are dropped
+
+    '''
+    def __init__(self, chip8, path, export_format='png', scale=DEFAULT_EXPORT_SCALE, queue_size=DEFAULT_QUEUE_SIZE):
+        if export_format not in EXPORT_FORMATS:
+            raise Exception(f'Unknown export format { export_format }.')
+        if scale < 1:
+            raise Exception('Export scales start at 1.')  # Checked here, as the writer thread would only fail on close
+
+        self.chip8 = chip8
+        self.path = path
+        self.export_format = export_format
+        self.scale = scale
+
+        self.frame = 0
+        self.written_frames = 0  # Frames encoded, counted by the writer thread
+        self.padded_frames = 0  # Repeats of the last frame written to videos over skipped frames, also counted there
+        self.duplicate_frames = 0
+        self.dropped_frames = 0
+
+        self._last_rows = None  # Rows of the last frame queued
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None  # Raised again by close if the writer thread fails
+        self._closing = False  # Set by the writer thread once it has taken the last item off the queue
+
+        # The output is opened here, so that a bad path fails straight away instead of on the writer thread
+        if export_format == 'y4m':
+            self._video_file = open(path, 'wb')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        self._writer = threading.Thread(target=self._write_frames, daemon=True)
+        self._writer.start()
+
+    def record(self):
+        '''Queue the frame that just ran, unless it's a duplicate or the writer thread is too far behind.'''
+        rows = tuple(self.chip8.display.rows)
+        frame = self.frame
+        self.frame += 1
+
+        if rows == self._last_rows:
+            self.duplicate_frames += 1
+            return
+
+        try:
+            self._queue.put_nowait((frame, rows))
+        except queue.Full:
+            self.dropped_frames += 1
+            return
+
+        self._last_rows = rows
+
+    def close(self):
+        '''Wait for the writer thread to write every queued frame, then close the output.'''
+        self._queue.put((self.frame, None))  # Frame count the video is padded to
+        self._writer.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _write_frames(self):
+        '''Writer thread body, which encodes and writes queued frames until close is called.'''
+        try:
+            if self.export_format == 'y4m':
+                self._write_video()
+            else:
+                self._write_images()
+        except Exception as error:
+            self._error = error
+            # Keep draining, so that close never blocks on a full queue
+            while not self._closing:
+                self._get_frame()
+
+    def _get_frame(self):
+        '''Wait for the next queued (frame, rows) pair, where rows is None once close has been called.'''
+        (frame, rows) = self._queue.get()
+        if rows is None:
+            self._closing = True
+
+        return (frame, rows)
+
+    def _write_images(self):
+        '''Write every queued frame to a numbered image file.'''
+        encode = encode_png if self.export_format == 'png' else encode_pbm
+
+        (frame, rows) = self._get_frame()
+        while rows is not None:
+            with open(os.path.join(self.path, f'{ frame:06}.{ self.export_format }'), 'wb') as image_file:
+                image_file.write(encode(rows, self.scale))
+            self.written_frames += 1
+
+            (frame, rows) = self._get_frame()
+
+    def _write_video(self):
+        '''Write every queued frame to the video file, repeating the last one over skipped frames.'''
+        with self._video_file as video_file:
+            video_file.write(y4m_header(self.scale))
+            last_encoded = None
+            next_frame = 0
+
+            (frame, rows) = self._get_frame()
+            while True:
+                if last_encoded is not None:
+                    video_file.write(last_encoded * (frame - next_frame))
+                    self.padded_frames += frame - next_frame
+                if rows is None:
+                    break
+
+                last_encoded = encode_y4m_frame(rows, self.scale)
+                video_file.write(last_encoded)
+                self.written_frames += 1
+                next_frame = frame + 1
+
+                (frame, rows) = self._get_frame()
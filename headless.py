@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+'''This module contains the HeadlessIOManager class, which runs a Chip-8 machine without a terminal.'''
+
+from iobase import BaseIOManager
+
+
+class HeadlessIOManager(BaseIOManager):
+    '''Input/output manager with no display output and a scripted keypad.
+
+    Parameters:
+    chip8: Chip8 instance this manager serves
+    key_script: dict mapping frame numbers to the keys held from that frame on
+
+    '''
+    def __init__(self, chip8, key_script=None):
+        super().__init__(chip8)
+
+        self.key_script = key_script or {}
+        self.frame = 0
+
+    def run(self, main_loop):
+        '''Call main_loop straight away, since there is nothing to set up.'''
+        return main_loop()
+
+    def poll_input(self):
+        '''Apply the keys scripted for the frame that is about to run.'''
+        if self.frame in self.key_script:
+            self.chip8.keypad.release_all()
+            for value in self.key_script[self.frame]:
+                self.chip8.keypad.press(value)
+
+        self.frame += 1
+
+    def has_pending_input(self):
+        '''Return True while the key script has frames left to apply.'''
+        return any(frame >= self.frame for frame in self.key_script)
+
+    def press_key(self, value):
+        '''Hold down the key bound to value.'''
+        self.chip8.keypad.press(value)
+
+    def release_key(self, value):
+        '''Release the key bound to value.'''
+        self.chip8.keypad.release(value)
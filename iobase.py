@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+'''This module contains the interface every Chip-8 input/output backend implements.'''
+
+import json
+import os
+import time
+from framebuffer import ROW_MASK
+
+
+KEY_BINDINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'key_bindings.json')
+# Seconds, since terminals only report key presses and their repeats. It has to outlast the delay before a held
+# key starts repeating, 250 to 660 ms on most systems, or held keys drop out until then; taps stay held as long
+DEFAULT_KEY_RELEASE_TIMEOUT = 0.6
+REWIND_INPUT = -1  # Read by backends for the rewind key, alongside the values of Chip-8 keys
+
+
+def load_key_bindings():
+    '''Load the dict mapping keyboard characters to Chip-8 keys from key_bindings.json.'''
+    with open(KEY_BINDINGS_FILE) as config_file:
+        return json.load(config_file)
+
+
+class BaseIOManager:
+    '''Chip-8 machine input/output manager interface.
+
+    The display itself belongs to the machine, so managers only present chip8.display. Terminal backends
+    only translate their own events in _read_input, while poll_input holds the keys they report.
+
+    Parameters:
+    chip8: Chip8 instance this manager serves, which is told to use it
+
+    '''
+    def __init__(self, chip8):
+        self.chip8 = chip8
+        self.chip8.set_io_manager(self)
+
+        self.rewind_requested = False  # Set to have the scheduler rewind the machine by one frame
+
+    def run(self, main_loop):
+        '''Set up whatever the backend needs, call main_loop and return its result.'''
+        raise NotImplementedError
+
+    def poll_input(self):
+        '''Update chip8.keypad with every input read since the last frame, called once at the start of every frame.'''
+        keypad = self.chip8.keypad
+        current_time = time.perf_counter()
+
+        # Expired keys are released first, so that a key repeat arriving this frame keeps its key held
+        keypad.release_expired(current_time)
+
+        for value in self._read_input():
+            if value == REWIND_INPUT:
+                self.rewind_requested = True
+            else:
+                keypad.press(value, current_time)
+
+    def has_pending_input(self):
+        '''Return False once no input can arrive any more, so that a machine waiting for a key would wait forever.'''
+        return True
+
+    def present(self):
+        '''Show the machine's display, called once at the end of every frame.'''
+        pass
+
+    def play_tone(self, time):
+        '''Play a single tone for (time * 1/60) seconds.'''
+        pass
+
+    def _read_input(self):
+        '''Return every key pressed since the last frame, as Chip-8 key values or REWIND_INPUT.'''
+        return ()
+
+    def _invalidate_presented_rows(self):
+        '''Forget what the backend is showing in _presented_rows, so that the next frame is presented in full.'''
+        # The complement of every row differs from it in every pixel
+        self._presented_rows = [~row & ROW_MASK for row in self.chip8.display.rows]
+        self.chip8.display.dirty = True
@@ -1,165 +1,139 @@
 #!/usr/bin/env python3
 '''This module contains the classes that manage the input/output operations of a Chip-8 virtual machine.'''
 
-import json
-import threading
-import time
-from decompiler import decompile_instruction
 from asciimatics.screen import Screen
 from asciimatics.event import KeyboardEvent
+from framebuffer import DISPLAY_WIDTH, DISPLAY_HEIGHT
+from memorybuffer import MEMORY_SIZE
+from iobase import BaseIOManager, DEFAULT_KEY_RELEASE_TIMEOUT, REWIND_INPUT, load_key_bindings
 
 
-def hex_to_binary(hex_value):
-    '''Return the binary equivalent of a hexadecimal value.'''
-    binary_length = len(hex_value) * 4
-    return (bin(int(hex_value, 16))[2:]).zfill(binary_length)
+REWIND_KEY = Screen.KEY_BACK
+DISASSEMBLY_CONTEXT = 2  # Instructions shown before and after the PC
+DISASSEMBLY_WIDTH = 28  # Characters
 
 
-def fix_overflowing_coordinates(coord_x, coord_y):
-    '''If a sprite coordinate gets out of the display bounds, returns its fixed position.'''
-    return (coord_x % 64, coord_y % 32)
+class IOManager(BaseIOManager):
+    '''Chip-8 machine input/output manager that runs in the terminal.
 
+    Parameters:
+    chip8: Chip8 instance this manager serves
+    show_debug_info: if True, the registers are printed under the display and the disassembly around the PC
+                     next to it, once per frame at most and only when they change
+    key_release_timeout: seconds a key stays held after the terminal last reported it
 
-class IOManager():
-    '''Chip-8 machine input/output manager.'''
-    def __init__(self, chip8):
+    '''
+    def __init__(self, chip8, show_debug_info=True, key_release_timeout=DEFAULT_KEY_RELEASE_TIMEOUT):
         # Virtual machine
-        self.chip8 = chip8
-        self.chip8.set_io_manager(self)
+        super().__init__(chip8)
 
         # Input setup
         self._load_key_bindings_config()
+        self.chip8.keypad.release_timeout = key_release_timeout
 
         # Video setup
-        self.display_buffer = [[0] * 64 for _ in range(32)]  # 64x32 resolution
-        self._display_lock = threading.Lock()
-        self._dirty_bit = False
-        Screen.wrapper(self.main_loop, catch_interrupt=False)
+        self.show_debug_info = show_debug_info
+        self._printed_debug_state = None  # What the debug info was last printed from
+        if show_debug_info:
+            from decompiler import DisassemblyCache  # Only needed for the debug info
+            self._disassembly = DisassemblyCache(chip8.memory)
+        self._presented_rows = [0] * DISPLAY_HEIGHT  # What the terminal is currently showing
 
-    def main_loop(self, screen):
-        '''Emulates a Chip-8 machine cycle.'''
-        self.screen = screen
-
-        while True:
-            self.chip8.step()
-
-            with self._display_lock:
-                self.print_debug_info()
-
-                if self._dirty_bit:
-                    self._draw_screen()
-                    screen.refresh()
-
-                    self._dirty_bit = False
-
-    def draw_sprite(self, sprite, pos_x, pos_y):
-        '''Draw a sprite in the specified coordinates.'''
-        binary_sprite = hex_to_binary(sprite)
+    def run(self, main_loop):
+        '''Open the terminal, call main_loop and return its result.'''
+        return Screen.wrapper(self._run_in_screen, catch_interrupt=False, arguments=[main_loop])
 
-        with self._display_lock:
-            for (index, sprite_bit) in enumerate(binary_sprite):
-                xored_bit = 0
-                (corrected_x, corrected_y) = fix_overflowing_coordinates(pos_x + index, pos_y)
-                screen_char = chr(self.screen.get_from(corrected_x, corrected_y)[0])
-                if (sprite_bit == '0' and screen_char == 'X') or (sprite_bit == '1' and screen_char == ' '):
-                    xored_bit = 1
-                self.display_buffer[corrected_y][corrected_x] = xored_bit
+    def present(self):
+        '''Copy the display and the debug info to the terminal.'''
+        if self.show_debug_info:
+            self.print_debug_info()
 
-            self._dirty_bit = True
+        if self.chip8.display.dirty:
+            self._draw_screen()
+            self.chip8.display.dirty = False
 
-    def check_collission(self, sprite, pos_x, pos_y):
-        '''Returns True if sprite collides with what is already drawn in the given coordinates.'''
-        (corrected_x, corrected_y) = fix_overflowing_coordinates(pos_x, pos_y)
-        with self._display_lock:
-            sprite_displayed = self._get_displayed_sprite_at(corrected_x, corrected_y)
-
-        return int(sprite, 16) & sprite_displayed
+        self.screen.refresh()
 
     def print_debug_info(self):
-        '''Print CPU-related info to the screen for debugging purposes.'''
+        '''Print the registers and the disassembly around the PC, if anything they show changed since they were last printed.'''
+        chip8 = self.chip8
+        debug_state = (chip8.reg_pc, chip8.reg_i, chip8.delay_timer.get_value(), tuple(chip8.reg_v), tuple(chip8.stack),
+                       self._disassembly.generation)
+        if debug_state == self._printed_debug_state:
+            return
+        self._printed_debug_state = debug_state
+
         self.screen.print_at(' ' * 96, 0, 34)
         self.screen.print_at(' ' * 64, 0, 35)
         self.screen.print_at(' ' * 64, 0, 36)
-        self.screen.print_at(f'REGISTERS: { self.chip8.reg_v }', 0, 34)
-        self.screen.print_at(f'STACK: { self.chip8.stack }', 0, 35)
-        self.screen.print_at(f'PC: { hex(self.chip8.reg_pc)[2:].upper() }    I: { hex(self.chip8.reg_i)[2:].upper() }   DT: { self.chip8.delay_timer.get_value() }', 0, 36)
-
-        """
-        self.screen.print_at('                       ', 34, 1)
-        self.screen.print_at('                       ', 34, 2)
-        self.screen.print_at('                       ', 34, 3)
-        self.screen.print_at('                       ', 34, 4)
-        self.screen.print_at('                       ', 34, 5)
-
-        try:
-            self.screen.print_at('    ' + decompile_instruction(self.chip8.memory.read_word_from_addr(self.chip8.reg_pc - 4)) + '    ', 34, 1)
-            self.screen.print_at('    ' + decompile_instruction(self.chip8.memory.read_word_from_addr(self.chip8.reg_pc - 2)) + '    ', 34, 2)
-        except:
-            pass
-
-        self.screen.print_at('--> ' + decompile_instruction(self.chip8.memory.read_word_from_addr(self.chip8.reg_pc)) + ' <--', 34, 3)
-        self.screen.print_at('    ' + decompile_instruction(self.chip8.memory.read_word_from_addr(self.chip8.reg_pc + 2)) + '    ', 34, 4)
-        self.screen.print_at('    ' + decompile_instruction(self.chip8.memory.read_word_from_addr(self.chip8.reg_pc + 4)) + '    ', 34, 5)
-        """
-
-    def clear_screen(self):
-        '''Set all the display buffer bytes to zero.'''
-        self.display_buffer = [[0] * 64 for _ in range(32)]
-
-    def is_key_pressed(self, value):
-        '''Returns true if the key binding of the pressed key equals value.'''
-        self.screen.wait_for_input(.00000001)
-        key_event = self.screen.get_event()
-        if key_event is None or not isinstance(key_event, KeyboardEvent):
-            return False
-        key_pressed = chr(key_event.key_code)
-
-        try:
-            return self.key_binding[key_pressed] == value
-        except KeyError:
-            return self.is_key_pressed(value)
-
-    def wait_for_input(self):
-        '''Stop execution until a key is pressed, and return its key binding.'''
-        self.screen.wait_for_input(999999)
-        key_event = self.screen.get_event()
-
-        try:
-            key_pressed = chr(key_event.key_code)
-            return self.key_binding[key_pressed]
-        except AttributeError:
-            return self.wait_for_input()
-        except KeyError:
-            return self.wait_for_input()
+        self.screen.print_at(f'REGISTERS: { chip8.reg_v }', 0, 34)
+        self.screen.print_at(f'STACK: { chip8.stack }', 0, 35)
+        self.screen.print_at(f'PC: { hex(chip8.reg_pc)[2:].upper() }    I: { hex(chip8.reg_i)[2:].upper() }   DT: { chip8.delay_timer.get_value() }', 0, 36)
+
+        # Disassembly pane, to the right of the display
+        for (line, offset) in enumerate(range(-DISASSEMBLY_CONTEXT * 2, DISASSEMBLY_CONTEXT * 2 + 2, 2)):
+            addr = chip8.reg_pc + offset
+            text = ''
+            if 0 <= addr < MEMORY_SIZE - 1:
+                marker = '-->' if offset == 0 else '   '
+                text = f'{ marker } { addr:03X}: { self._disassembly.disassemble(addr) }'
+            self.screen.print_at(f'{ text:<{ DISASSEMBLY_WIDTH }}', DISPLAY_WIDTH + 2, line + 1)
 
     def play_tone(self, time):
         '''Play a single tone for (time * 1/60) seconds.'''
         # Empty because the Windows WSL where I work doesn't support audio
         pass
 
-    def _get_displayed_sprite_at(self, pos_x, pos_y):
-        '''Fetch what is being displayed at the given coordinates.'''
-        retval = '0b'
+    def _run_in_screen(self, screen, main_loop):
+        '''Call main_loop once the terminal is open.'''
+        self.screen = screen
+        self._invalidate_presented_rows()
+
+        return main_loop()
+
+    def _read_input(self):
+        '''Drain every pending terminal event, and return the keys they're bound to.'''
+        values = []
+
+        key_event = self.screen.get_event()
+        while key_event is not None:
+            if isinstance(key_event, KeyboardEvent):
+                if key_event.key_code == REWIND_KEY:
+                    values.append(REWIND_INPUT)
+                elif key_event.key_code in self._key_code_binding:
+                    values.append(self._key_code_binding[key_event.key_code])
+
+            key_event = self.screen.get_event()
 
-        for index in range(8):
-            (corrected_x, corrected_y) = fix_overflowing_coordinates(pos_x + index, pos_y)
-            if chr(self.screen.get_from(corrected_x, corrected_y)[0]) == 'X':
-                retval += '1'
-            else:
-                retval += '0'
+        return values
 
-        return int(retval, 2)
+    def _invalidate_presented_rows(self):
+        '''Forget what the terminal is showing, debug info included, so that the next frame is drawn in full.'''
+        super()._invalidate_presented_rows()
+        self._printed_debug_state = None
 
     def _draw_screen(self):
-        '''Copy the display buffer to the graphics library buffer.'''
-        for coord_y in range(32):
-            for coord_x in range(64):
-                if self.display_buffer[coord_y][coord_x] == 1:
+        '''Copy the pixels that changed since the last presented frame to the graphics library buffer.'''
+        rows = self.chip8.display.rows
+
+        for coord_y in range(DISPLAY_HEIGHT):
+            changed_pixels = rows[coord_y] ^ self._presented_rows[coord_y]
+
+            while changed_pixels:
+                pixel_bit = changed_pixels.bit_length() - 1
+                changed_pixels ^= 1 << pixel_bit
+                coord_x = DISPLAY_WIDTH - 1 - pixel_bit
+
+                if (rows[coord_y] >> pixel_bit) & 1:
                     self.screen.print_at('X', coord_x, coord_y, bg=Screen.COLOUR_WHITE)
                 else:
                     self.screen.print_at(' ', coord_x, coord_y, bg=Screen.COLOUR_BLACK)
 
+            self._presented_rows[coord_y] = rows[coord_y]
+
     def _load_key_bindings_config(self):
         '''Load key binding settings from key_bindings.json.'''
-        with open('key_bindings.json') as CONFIG_FILE:
-            self.key_binding = json.load(CONFIG_FILE)
+        self.key_binding = load_key_bindings()
+
+        # Terminal events carry key codes rather than characters
+        self._key_code_binding = {ord(key): value for (key, value) in self.key_binding.items()}
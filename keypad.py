@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+'''This module contains the Keypad class, which holds the state of the 16 Chip-8 keys.'''
+
+
+KEY_COUNT = 16
+
+
+class Keypad:
+    '''Pressed/released state of the Chip-8 hexadecimal keypad.
+
+    Input backends press and release keys once per frame, so that the skip instructions only look the
+    state up. Backends whose input never reports key releases, like most terminals, set a release timeout
+    instead: a key stays held until that long after the last event reporting it.
+
+    Parameters:
+    release_timeout: seconds a key is held after it was last pressed, or None to hold it until released
+
+    '''
+    def __init__(self, release_timeout=None):
+        self.release_timeout = release_timeout
+
+        self.pressed = [False] * KEY_COUNT
+        self._release_times = [None] * KEY_COUNT
+
+    def press(self, key, current_time=None):
+        '''Hold a key down, until it's released or its timeout runs out after current_time.'''
+        self.pressed[key] = True
+
+        if self.release_timeout is not None and current_time is not None:
+            self._release_times[key] = current_time + self.release_timeout
+
+    def release(self, key):
+        '''Release a key.'''
+        self.pressed[key] = False
+        self._release_times[key] = None
+
+    def release_all(self):
+        '''Release every key.'''
+        for key in range(KEY_COUNT):
+            self.release(key)
+
+    def release_expired(self, current_time):
+        '''Release every key whose timeout ran out by current_time.'''
+        for key in range(KEY_COUNT):
+            release_time = self._release_times[key]
+            if release_time is not None and release_time <= current_time:
+                self.release(key)
+
+    def is_pressed(self, key):
+        '''Returns True if the key is held, and False for values outside the keypad.'''
+        return key < KEY_COUNT and self.pressed[key]
@@ -1,23 +1,238 @@
 #!/usr/bin/env python3
 '''This module is the main body of the emulator.'''
 
-from sys import argv
-from vm import Chip8
-from iomanager import IOManager
+import time
+START_TIME = time.perf_counter()  # Taken before anything else is imported, for --startup-timing
+
+from argparse import ArgumentParser, ArgumentTypeError
+from vm import Chip8, ENGINES
+from frameexport import FrameExporter, DEFAULT_EXPORT_SCALE, EXPORT_FORMATS
+from headless import HeadlessIOManager
+from iobase import DEFAULT_KEY_RELEASE_TIMEOUT
+from recording import Recorder, load_recording, new_seed, replay
+from savestate import RewindBuffer
+from scheduler import Scheduler, DEFAULT_CLOCK_SPEED, DEFAULT_SPIN_TIME, FRAME_RATE
+
+
+RENDERERS = ('asciimatics', 'ansi')
 
 
 def load_rom(input_file):
     '''Load ROM file from the command line.'''
     try:
         with open(input_file, 'rb') as rom_file:
-            return rom_file.read().hex().upper()
+            return rom_file.read()
     except IOError:
         print("Error: file not found")
         exit(1)
 
 
+def positive_int(text):
+    '''Argument type for whole numbers no smaller than 1.'''
+    value = int(text)
+    if value < 1:
+        raise ArgumentTypeError(f'{ value } is not a positive whole number')
+
+    return value
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Chip-8 emulator.')
+    parser.add_argument('rom', help='Chip-8 ROM file to run')
+    parser.add_argument('--engine', choices=ENGINES, default='interpreter',
+                        help='run instructions one at a time or as compiled basic blocks')
+    parser.add_argument('--threaded-timers', action='store_true',
+                        help='count the timers down in their own threads, following the host clock')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without a terminal and report the throughput on exit')
+    parser.add_argument('--clock', type=int, default=DEFAULT_CLOCK_SPEED,
+                        help=f'instructions per second (default { DEFAULT_CLOCK_SPEED })')
+    parser.add_argument('--unthrottled', action='store_true',
+                        help='run frames as fast as possible instead of 60 per second (always on when headless)')
+    parser.add_argument('--spin-time', type=float, default=DEFAULT_SPIN_TIME,
+                        help=f'seconds busy-waited before every frame instead of slept (default { DEFAULT_SPIN_TIME })')
+    parser.add_argument('--rewind', type=float, default=0, metavar='SECONDS',
+                        help='keep this many seconds of history to rewind through with backspace (default 0)')
+    parser.add_argument('--profile', action='store_true',
+                        help='count the executions and host time of every instruction and print a report on exit')
+    parser.add_argument('--record', metavar='FILE', help='record the seed and the keypad input of this run to FILE')
+    parser.add_argument('--record-hashes', action='store_true',
+                        help='also record a hash of the display every frame, to verify replays with')
+    parser.add_argument('--replay', metavar='FILE', help='replay a recording of this ROM headless, as fast as possible and on the engine it was recorded with')
+    parser.add_argument('--hash-stream', metavar='FILE', help='write the display hash of every replayed frame to FILE')
+    parser.add_argument('--export', metavar='PATH',
+                        help='stream every frame to PATH, a folder of numbered images or a .y4m video file')
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS,
+                        help='format to export frames in (default: y4m if PATH ends in .y4m, png otherwise)')
+    parser.add_argument('--export-scale', type=positive_int, default=DEFAULT_EXPORT_SCALE,
+                        help=f'image pixels per Chip-8 pixel when exporting (default { DEFAULT_EXPORT_SCALE })')
+    parser.add_argument('--debug', action='store_true',
+                        help='start paused, with debugger commands read from --debug-input (type help for a list)')
+    parser.add_argument('--debug-input', metavar='FILE', default='-',
+                        help='file or named pipe to read debugger commands from (default: stdin, only when headless)')
+    parser.add_argument('--debug-output', metavar='FILE', default='-',
+                        help='file or named pipe to write debugger output to (default: stdout)')
+    parser.add_argument('--startup-timing', action='store_true',
+                        help='report how long it took to get to the first instruction and the first presented frame')
+    parser.add_argument('--renderer', choices=RENDERERS, default='asciimatics',
+                        help='terminal backend: asciimatics, or ansi for two display rows per terminal row and one write per frame')
+    parser.add_argument('--no-debug-info', action='store_true', help='hide the registers under the display')
+    parser.add_argument('--key-release-timeout', metavar='SECONDS', type=float, default=DEFAULT_KEY_RELEASE_TIMEOUT,
+                        help=f'seconds a key stays held after the terminal last reported it (default { DEFAULT_KEY_RELEASE_TIMEOUT }); '
+                             'longer than the key repeat delay keeps held keys from dropping out, shorter releases taps sooner')
+    parser.add_argument('--cycles', type=int, help='exit after running this many instructions')
+    parser.add_argument('--frames', type=int, help='exit after running this many frames')
+
+    arguments = parser.parse_args()
+    if arguments.export and arguments.export_format is None:
+        arguments.export_format = 'y4m' if arguments.export.endswith('.y4m') else 'png'
+    if arguments.debug and not arguments.headless and '-' in (arguments.debug_input, arguments.debug_output):
+        parser.error('the terminal is taken by the display, so --debug needs --debug-input and --debug-output files')
+    if arguments.record and (arguments.rewind > 0 or arguments.threaded_timers or arguments.debug):
+        parser.error('recordings can\'t be replayed faithfully with --rewind, --threaded-timers or --debug')
+
+    return arguments
+
+
+def run_headless(scheduler, cycles, frames):
+    '''Run the virtual machine without a terminal and print how fast it went.'''
+    start_time = time.perf_counter()
+    executed = scheduler.run(frames=frames, cycles=cycles)
+    elapsed_time = time.perf_counter() - start_time
+
+    # Skipped idle loop iterations are counted as executed, but they took no time to run
+    skipped = scheduler.skipped
+    executed -= skipped
+    print(f'Executed { executed } instructions in { scheduler.frame } frames '
+          f'and { elapsed_time:.3f} seconds ({ executed / elapsed_time:.0f} instructions/s), '
+          f'skipping { skipped } more in idle loops')
+    if scheduler.chip8.is_halted():
+        print('Stopped waiting for a key, with no more input to come')
+
+
+def run_replay(recording_path, program, hash_stream_path):
+    '''Replay a recording headless and print how fast it went and whether it matched.'''
+    recording = load_recording(recording_path)
+
+    hash_stream = open(hash_stream_path, 'w') if hash_stream_path else None
+    try:
+        result = replay(recording, program, hash_stream)
+    finally:
+        if hash_stream is not None:
+            hash_stream.close()
+
+    print(f'Replayed { result["frames"] } frames and { result["instructions"] } instructions '
+          f'in { result["seconds"]:.3f} seconds ({ result["instructions"] / result["seconds"]:.0f} instructions/s), '
+          f'skipping { result["skipped_instructions"] } more in idle loops')
+    if recording['frame_hashes'] is not None:
+        if result['mismatched_frame'] is None:
+            print('Every frame matched the recording')
+        else:
+            print(f'Frame { result["mismatched_frame"] } is the first that differs from the recording')
+
+
+def time_startup(chip8, timings):
+    '''Record in timings when the machine first runs and first presents a frame, in seconds since START_TIME.'''
+    # One-shot wrappers that put the original functions back as soon as they're called
+    engine_run = chip8.__dict__.get('run')
+    io_manager = chip8.io_manager
+
+    def first_run(cycles):
+        timings['first instruction'] = time.perf_counter() - START_TIME
+        if engine_run is None:
+            del chip8.run
+        else:
+            chip8.run = engine_run
+        return chip8.run(cycles)
+
+    def first_present():
+        del io_manager.present
+        io_manager.present()
+        timings['first frame presented'] = time.perf_counter() - START_TIME
+
+    chip8.run = first_run
+    io_manager.present = first_present
+
+
+def print_startup_timing(timings):
+    '''Print the startup milestones in the order they were reached.'''
+    print('Startup timing:')
+    for (milestone, seconds) in sorted(timings.items(), key=lambda item: item[1]):
+        print(f'  { milestone:<24} { seconds * 1000:8.1f} ms')
+
+
 if __name__ == "__main__":
-    GAME_ROM = load_rom(argv[1])
+    STARTUP_TIMINGS = {'imports done': time.perf_counter() - START_TIME}
+    ARGUMENTS = parse_arguments()
+    GAME_ROM = load_rom(ARGUMENTS.rom)
+
+    if ARGUMENTS.replay:
+        run_replay(ARGUMENTS.replay, GAME_ROM, ARGUMENTS.hash_stream)
+        exit(0)
+
+    seed = new_seed() if ARGUMENTS.record else None
+    chip8 = Chip8(GAME_ROM, engine=ARGUMENTS.engine, threaded_timers=ARGUMENTS.threaded_timers, seed=seed)
+    if ARGUMENTS.headless:
+        HeadlessIOManager(chip8)
+    elif ARGUMENTS.renderer == 'ansi':
+        from ansiterminal import ANSIIOManager
+        ANSIIOManager(chip8, show_debug_info=not ARGUMENTS.no_debug_info, key_release_timeout=ARGUMENTS.key_release_timeout)
+    else:
+        from iomanager import IOManager  # Imported here, so that headless runs never load the terminal library
+        IOManager(chip8, show_debug_info=not ARGUMENTS.no_debug_info, key_release_timeout=ARGUMENTS.key_release_timeout)
 
-    chip8 = Chip8(GAME_ROM)
-    io_manager = IOManager(chip8)
+    rewind_buffer = None
+    if ARGUMENTS.rewind > 0:
+        rewind_buffer = RewindBuffer(chip8, capacity=round(ARGUMENTS.rewind * FRAME_RATE))
+
+    # Debugging headless is still paced, so that a paused machine doesn't spin
+    scheduler = Scheduler(chip8, clock_speed=ARGUMENTS.clock, spin_time=ARGUMENTS.spin_time,
+                          throttle=not ((ARGUMENTS.headless and not ARGUMENTS.debug) or ARGUMENTS.unthrottled),
+                          rewind_buffer=rewind_buffer)
+
+    recorder = None
+    if ARGUMENTS.record:
+        recorder = Recorder(chip8, GAME_ROM, seed, ARGUMENTS.clock, record_hashes=ARGUMENTS.record_hashes)
+        scheduler.add_frame_listener(recorder.record)
+
+    exporter = None
+    if ARGUMENTS.export:
+        exporter = FrameExporter(chip8, ARGUMENTS.export, ARGUMENTS.export_format, scale=ARGUMENTS.export_scale)
+        scheduler.add_frame_listener(exporter.record)
+
+    profiler = None
+    if ARGUMENTS.profile:
+        from profiler import Profiler
+        profiler = Profiler(chip8)
+        profiler.enable()
+
+    if ARGUMENTS.debug:
+        from debugger import Debugger
+        debugger = Debugger(chip8)
+        debugger.listen(None if ARGUMENTS.debug_input == '-' else open(ARGUMENTS.debug_input),
+                        None if ARGUMENTS.debug_output == '-' else open(ARGUMENTS.debug_output, 'w'))
+        debugger.pause()
+
+    if ARGUMENTS.startup_timing:
+        STARTUP_TIMINGS['machine ready'] = time.perf_counter() - START_TIME
+        time_startup(chip8, STARTUP_TIMINGS)
+
+    try:
+        if ARGUMENTS.headless:
+            run_headless(scheduler, ARGUMENTS.cycles, ARGUMENTS.frames)
+        else:
+            scheduler.run(frames=ARGUMENTS.frames, cycles=ARGUMENTS.cycles)
+    finally:
+        if recorder is not None:
+            recorder.save(ARGUMENTS.record)
+        if exporter is not None:
+            exporter.close()
+            skipped_frames = f'{ exporter.duplicate_frames } duplicates skipped, { exporter.dropped_frames } dropped'
+            if ARGUMENTS.export_format == 'y4m':
+                skipped_frames += f', { exporter.padded_frames } padding repeats of the frame before'
+            print(f'Exported { exporter.written_frames } frames to { ARGUMENTS.export } ({ skipped_frames })')
+        if profiler is not None:
+            print(profiler.format_report())
+        if ARGUMENTS.startup_timing:
+            print_startup_timing(STARTUP_TIMINGS)
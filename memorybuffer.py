@@ -2,7 +2,7 @@
 '''This module contains the MemoryBuffer class.'''
 
 
-FONTSET = 'F0909090F0\
+FONTSET = bytes.fromhex('F0909090F0\
 2060202070\
 F010F080F0\
 F010F010F0\
@@ -17,55 +17,103 @@ E090E090E0\
 F0808080F0\
 E0909090E0\
 F080F080F0\
-F080F08080'
+F080F08080')
+
+MEMORY_SIZE = 4096
+PROGRAM_START = 512
 
 
 class MemoryBuffer:
-    '''Emulated Chip-8 memory.'''
+    '''Emulated Chip-8 memory.
+
+    Parameters:
+    program: Chip-8 binary as a bytes-like object
+
+    '''
     def __init__(self, program):
-        self.memory = ['00'] * 4096
-        program_size_in_bytes = len(program) // 2
+        if len(program) > MEMORY_SIZE - PROGRAM_START:
+            raise ValueError(f'Programs can be no larger than { MEMORY_SIZE - PROGRAM_START } bytes.')
+
+        self.memory = bytearray(MEMORY_SIZE)
+        self._view = memoryview(self.memory)
+        self._write_listeners = []
+        self._restore_listeners = []
 
-        self[0:80] = FONTSET
-        self[512:512+program_size_in_bytes] = program
+        self.memory[0:len(FONTSET)] = FONTSET
+        self.memory[PROGRAM_START:PROGRAM_START+len(program)] = program
 
     def __setitem__(self, subscript, data):
         if isinstance(subscript, slice):
-            new_slice = [data[i:i+2] for i in range(0, len(data), 2)]
-            self.memory = self.memory[:subscript.start] + new_slice + self.memory[subscript.stop:]
+            self.write_data_to_addr(data, subscript.start or 0)
         else:
-            self.memory = self.memory[:subscript] + data + self.memory[subscript+1:]
+            self.write_byte_to_addr(data, subscript)
 
     def __getitem__(self, subscript):
-        if isinstance(subscript, slice):
-            return ''.join(self.memory[slice.start, slice.stop])
-        else:
-            return self.memory[subscript]
+        return self.memory[subscript]
+
+    def __len__(self):
+        return MEMORY_SIZE
 
     def __str__(self):
-        print(self.memory)
+        return self.memory.hex().upper()
+
+    def add_write_listener(self, listener):
+        '''Call listener(addr, n_bytes) every time the program writes to memory.'''
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        '''Stop calling a listener previously added with add_write_listener.'''
+        self._write_listeners.remove(listener)
+
+    def add_restore_listener(self, listener):
+        '''Call listener(addr, n_bytes) every time memory is restored by restore_data_to_addr.'''
+        self._restore_listeners.append(listener)
+
+    def remove_restore_listener(self, listener):
+        '''Stop calling a listener previously added with add_restore_listener.'''
+        self._restore_listeners.remove(listener)
 
     def read_word_from_addr(self, addr):
-        '''Read 2 bytes from the specified memory address.'''
-        return self.read_data_from_addr(addr, 2)
+        '''Read 2 bytes from the specified memory address as an integer.'''
+        memory = self.memory
+        return (memory[addr] << 8) | memory[addr + 1]
 
     def read_byte_from_addr(self, addr):
-        '''Read 1 byte from the specified memory address.'''
-        return self.read_data_from_addr(addr, 1)
+        '''Read 1 byte from the specified memory address as an integer.'''
+        return self.memory[addr]
 
     def read_data_from_addr(self, addr, bytes_to_read):
-        '''Read n bytes from the specified memory address.'''
-        return ''.join(self.memory[addr:addr+bytes_to_read])
+        '''Read n bytes from the specified memory address without copying them.'''
+        return self._view[addr:addr+bytes_to_read]
 
     def write_word_to_addr(self, data, addr):
         '''Write 2 bytes to the specified memory address.'''
-        self._write_data_to_addr(data, addr, 2)
+        self.memory[addr] = (data >> 8) & 0xFF
+        self.memory[addr + 1] = data & 0xFF
+        self._notify_write(addr, 2)
 
     def write_byte_to_addr(self, data, addr):
         '''Write 1 byte to the specified memory address.'''
-        self._write_data_to_addr(data, addr, 1)
+        self.memory[addr] = data
+        self._notify_write(addr, 1)
+
+    def write_data_to_addr(self, data, addr):
+        '''Write a bytes-like object to the specified memory address.'''
+        if addr + len(data) > MEMORY_SIZE:
+            raise IndexError('Memory write out of bounds.')
+        self.memory[addr:addr+len(data)] = data
+        self._notify_write(addr, len(data))
+
+    def restore_data_to_addr(self, data, addr):
+        '''Write a bytes-like object to the specified memory address on behalf of the host, like loading a save state.'''
+        # Write listeners aren't called, since the program didn't write anything
+        if addr + len(data) > MEMORY_SIZE:
+            raise IndexError('Memory write out of bounds.')
+        self.memory[addr:addr+len(data)] = data
+        for listener in self._restore_listeners:
+            listener(addr, len(data))
 
-    def _write_data_to_addr(self, data, addr, n_bytes):
-        '''Write n bytes to the specified memory address.'''
-        data = hex(data)[2:].zfill(n_bytes * 2)
-        self.memory[addr:addr+n_bytes] = [data[i:i+2] for i in range(0, len(data), 2)]  # Separates the data into byte-sized chunks
+    def _notify_write(self, addr, n_bytes):
+        '''Let every write listener know that n bytes were written at addr.'''
+        for listener in self._write_listeners:
+            listener(addr, n_bytes)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''This module contains the Profiler class, which measures where a Chip-8 program spends its time.'''
+
+import time
+from collections import defaultdict
+from vm import ExecutionHalted, install_step_hook, remove_step_hook
+
+
+def opcode_family(instruction):
+    '''Return the name of the opcode family a 16-bit instruction belongs to, such as 8xy4 or Fx0A.'''
+    category = instruction >> 12
+
+    if category == 0x0:
+        return {0x00E0: '00E0', 0x00EE: '00EE'}.get(instruction, '0nnn')
+    elif category == 0x8:
+        return f'8xy{ instruction & 0xF:X}'
+    elif category in (0xE, 0xF):
+        return f'{ category:X}x{ instruction & 0xFF:02X}'
+    elif category in (0x5, 0x9):
+        return f'{ category:X}xy0'
+    elif category == 0xD:
+        return 'Dxyn'
+    elif category in (0x1, 0x2, 0xA, 0xB):
+        return f'{ category:X}nnn'
+    else:
+        return f'{ category:X}xkk'
+
+
+class Profiler:
+    '''Counts how many times every instruction runs and how much host time it takes.
+
+    While enabled, the machine's step function is replaced by a profiling one and every engine runs
+    through it one instruction at a time, so that counts are kept per address and per instruction run
+    there, which self-modifying programs can change. Disabling restores the original functions, so an
+    idle profiler costs nothing. Skipped idle loop iterations aren't counted.
+
+    Parameters:
+    chip8: Chip8 instance to profile
+
+    '''
+    def __init__(self, chip8):
+        self.chip8 = chip8
+        self.enabled = False
+
+        self.executions = defaultdict(int)  # Indexed by (address, instruction)
+        self.host_times = defaultdict(float)  # Seconds, indexed by (address, instruction)
+
+    def enable(self):
+        '''Start profiling every instruction the machine executes.'''
+        if self.enabled:
+            return
+
+        install_step_hook(self.chip8, self)
+        self.enabled = True
+
+    def disable(self):
+        '''Stop profiling and go back to the machine's own step and run functions.'''
+        if not self.enabled:
+            return
+
+        remove_step_hook(self.chip8, self)
+        self.enabled = False
+
+    def reset(self):
+        '''Forget everything measured so far.'''
+        self.executions = defaultdict(int)
+        self.host_times = defaultdict(float)
+
+    def family_totals(self):
+        '''Return a dict mapping opcode families to their (executions, host time) totals.'''
+        totals = defaultdict(lambda: [0, 0.0])
+
+        for (addr, instruction) in self.host_times:
+            family = totals[opcode_family(instruction)]
+            family[0] += self.executions[(addr, instruction)]
+            family[1] += self.host_times[(addr, instruction)]
+
+        return {family: tuple(total) for (family, total) in totals.items()}
+
+    def format_report(self, top=20):
+        '''Return a text report of the opcode families and the top hottest addresses.'''
+        from decompiler import decompile_instruction  # Only needed for the report
+        total_executions = sum(self.executions.values()) or 1
+        total_time = sum(self.host_times.values()) or 1
+
+        lines = [
+            f'{ "Family":<8} { "Executions":>12} { "%":>6} { "Host ms":>10} { "%":>6} { "ns/exec":>8}'
+        ]
+        families = sorted(self.family_totals().items(), key=lambda item: item[1][1], reverse=True)
+        for (family, (executions, host_time)) in families:
+            ns_per_execution = f'{ host_time / executions * 1e9:.0f}' if executions else '-'  # Only ever halted
+            lines.append(f'{ family:<8} { executions:>12} { executions / total_executions:>6.1%} '
+                         f'{ host_time * 1000:>10.2f} { host_time / total_time:>6.1%} '
+                         f'{ ns_per_execution:>8}')
+
+        lines += [
+            '',
+            f'{ "Address":<8} { "Executions":>12} { "%":>6} { "Host ms":>10} { "%":>6}  Instruction'
+        ]
+        hot_instructions = sorted(self.host_times, key=self.host_times.get, reverse=True)
+        for (addr, instruction) in hot_instructions[:top]:
+            try:
+                disassembly = decompile_instruction(instruction)
+            except Exception:
+                disassembly = '???'
+
+            executions = self.executions[(addr, instruction)]
+            host_time = self.host_times[(addr, instruction)]
+            lines.append(f'{ addr:03X}      { executions:>12} { executions / total_executions:>6.1%} '
+                         f'{ host_time * 1000:>10.2f} { host_time / total_time:>6.1%}  '
+                         f'{ instruction:04X}  { disassembly }')
+
+        return '\n'.join(lines)
+
+    def _step(self):
+        '''Replacement for Chip8.step that times the instruction it executes.'''
+        chip8 = self.chip8
+        key = (chip8.reg_pc, chip8.memory.read_word_from_addr(chip8.reg_pc))
+        start_time = time.perf_counter()
+        halted = False
+        try:
+            self._next_step()
+        except ExecutionHalted:
+            halted = True  # The instruction didn't run, though the time spent on it is still recorded
+            raise
+        finally:
+            # IdleLoop is raised after the jump closing the loop has run, so it's counted like any other
+            self.host_times[key] += time.perf_counter() - start_time
+            if not halted:
+                self.executions[key] += 1
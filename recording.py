@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+'''This module records the seed and keypad input of a run, and replays recordings headless.'''
+
+import hashlib
+import random
+import struct
+import time
+import zlib
+from headless import HeadlessIOManager
+from keypad import KEY_COUNT
+from scheduler import Scheduler
+from vm import Chip8, ENGINES
+
+
+RECORDING_MAGIC = b'C8RC'
+RECORDING_VERSION = 1
+FRAME_HASH_SIZE = 8  # Bytes
+
+# Magic, version, whether frame hashes follow the keypad states, engine, seed, clock speed, ROM hash, frame count
+_HEADER_FORMAT = struct.Struct('<4sB?BQI32sI')
+
+
+def new_seed():
+    '''Return a random seed for a machine that is going to be recorded.'''
+    return random.getrandbits(64)
+
+
+def frame_hash(chip8):
+    '''Return a short hash of the machine's display.'''
+    return hashlib.blake2b(bytes(chip8.display), digest_size=FRAME_HASH_SIZE).digest()
+
+
+def keypad_state(keypad):
+    '''Return the held keys as a 16-bit mask, with key k in bit k.'''
+    return sum(1 << key for key in range(KEY_COUNT) if keypad.pressed[key])
+
+
+class Recorder:
+    '''Records the keypad state at every frame, and optionally a hash of the display.
+
+    Together with the seed of the machine's random number generator and the clock speed this is enough
+    to run the same frames again. Both engines run the same instructions every frame, so the engine is
+    only kept so that replays run on the one the recording was made with, in case it misbehaves. Add
+    record as a frame listener of the scheduler running the machine.
+
+    Parameters:
+    chip8: Chip8 instance to record, created with the given seed
+    program: Chip-8 binary the machine was loaded with
+    seed: seed the machine's random number generator was created with
+    clock_speed: emulated instructions per second the machine is run at
+    record_hashes: if True, the display is hashed at the end of every frame to verify replays with
+
+    '''
+    def __init__(self, chip8, program, seed, clock_speed, record_hashes=False):
+        self.chip8 = chip8
+        self.engine = chip8.engine
+        self.seed = seed
+        self.clock_speed = clock_speed
+        self.rom_hash = hashlib.sha256(program).digest()
+
+        self.keypad_states = []
+        self.frame_hashes = [] if record_hashes else None
+
+    def record(self):
+        '''Record the frame that just ran.'''
+        self.keypad_states.append(keypad_state(self.chip8.keypad))
+        if self.frame_hashes is not None:
+            self.frame_hashes.append(frame_hash(self.chip8))
+
+    def save(self, path):
+        '''Write the recording to a file.'''
+        frames = len(self.keypad_states)
+        body = struct.pack(f'<{ frames }H', *self.keypad_states)
+        if self.frame_hashes is not None:
+            body += b''.join(self.frame_hashes)
+
+        with open(path, 'wb') as recording_file:
+            recording_file.write(_HEADER_FORMAT.pack(
+                RECORDING_MAGIC, RECORDING_VERSION, self.frame_hashes is not None, ENGINES.index(self.engine),
+                self.seed, self.clock_speed, self.rom_hash, frames
+            ))
+            recording_file.write(zlib.compress(body, 9))
+
+
+def load_recording(path):
+    '''Read a recording saved by Recorder.save and return it as a dict.'''
+    with open(path, 'rb') as recording_file:
+        data = recording_file.read()
+
+    (magic, version, has_hashes, engine, seed, clock_speed, rom_hash, frames) = _HEADER_FORMAT.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise Exception('Not a recording, or recorded by an incompatible version.')
+
+    body = zlib.decompress(data[_HEADER_FORMAT.size:])
+    frame_hashes = None
+    if has_hashes:
+        hashes_start = frames * 2
+        frame_hashes = [body[start:start+FRAME_HASH_SIZE]
+                        for start in range(hashes_start, hashes_start + frames * FRAME_HASH_SIZE, FRAME_HASH_SIZE)]
+
+    return {
+        'engine': ENGINES[engine],
+        'seed': seed,
+        'clock_speed': clock_speed,
+        'rom_hash': rom_hash,
+        'keypad_states': list(struct.unpack_from(f'<{ frames }H', body)),
+        'frame_hashes': frame_hashes
+    }
+
+
+def replay(recording, program, hash_stream=None):
+    '''
+    Run a recording headless and unthrottled on the engine it was recorded with, and return a dict with how it went.
+    If the recording has frame hashes, every frame is checked against them and the first one that
+    differs is reported as mismatched_frame. Every frame hash is also written to hash_stream if given,
+    one hex string per line.
+    '''
+    if hashlib.sha256(program).digest() != recording['rom_hash']:
+        raise Exception('The recording was made with a different ROM.')
+
+    chip8 = Chip8(program, engine=recording['engine'], seed=recording['seed'])
+
+    # Held keys only go into the script on the frames where they change
+    key_script = {}
+    last_state = 0
+    for (frame, state) in enumerate(recording['keypad_states']):
+        if state != last_state:
+            key_script[frame] = [key for key in range(KEY_COUNT) if state >> key & 1]
+            last_state = state
+    HeadlessIOManager(chip8, key_script)
+
+    scheduler = Scheduler(chip8, clock_speed=recording['clock_speed'], throttle=False)
+    result = {'mismatched_frame': None}
+
+    def check_frame():
+        frame = scheduler.frame - 1
+        current_hash = frame_hash(chip8)
+        if hash_stream is not None:
+            hash_stream.write(current_hash.hex() + '\n')
+
+        expected_hashes = recording['frame_hashes']
+        if expected_hashes is not None and result['mismatched_frame'] is None and current_hash != expected_hashes[frame]:
+            result['mismatched_frame'] = frame
+
+    if hash_stream is not None or recording['frame_hashes'] is not None:
+        scheduler.add_frame_listener(check_frame)
+
+    start_time = time.perf_counter()
+    executed = scheduler.run(frames=len(recording['keypad_states']))
+    result['seconds'] = time.perf_counter() - start_time
+    result['instructions'] = executed - scheduler.skipped
+    result['skipped_instructions'] = scheduler.skipped
+    result['frames'] = scheduler.frame
+
+    return result
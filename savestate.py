@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''This module saves and restores the full state of a Chip-8 machine, and keeps a rewind history of it.'''
+
+import struct
+import zlib
+from collections import deque
+from framebuffer import DISPLAY_HEIGHT
+from memorybuffer import MEMORY_SIZE
+
+
+STATE_MAGIC = b'C8ST'
+STATE_VERSION = 1
+MEMORY_CHUNK_SIZE = 64  # Bytes compared at a time when restoring memory
+
+# Magic, version, registers, I, PC, SP, stack, delay and sound timers, display rows
+_MACHINE_FORMAT = struct.Struct(f'<4sB16siiB16HBB{ DISPLAY_HEIGHT }Q')
+# Mersenne Twister state and index, whether there's a cached gaussian value and the value itself
+_RANDOM_FORMAT = struct.Struct('<625I?d')
+
+STATE_SIZE = _MACHINE_FORMAT.size + MEMORY_SIZE + _RANDOM_FORMAT.size
+
+
+def save_state(chip8):
+    '''Return the full state of the machine as bytes.'''
+    (random_version, random_state, gauss_next) = chip8.random.getstate()
+
+    return b''.join((
+        _MACHINE_FORMAT.pack(
+            STATE_MAGIC, STATE_VERSION,
+            bytes(chip8.reg_v), chip8.reg_i, chip8.reg_pc, chip8.reg_sp, *chip8.stack,
+            chip8.delay_timer.get_value(), chip8.sound_timer.get_value(),
+            *chip8.display.rows
+        ),
+        chip8.memory.memory,
+        _RANDOM_FORMAT.pack(*random_state, gauss_next is not None, gauss_next or 0.0)
+    ))
+
+
+def load_state(chip8, state):
+    '''Restore the machine to a state returned by save_state.'''
+    if len(state) != STATE_SIZE:
+        raise Exception('Invalid save state size.')
+
+    machine_values = _MACHINE_FORMAT.unpack_from(state)
+    (magic, version, reg_v, reg_i, reg_pc, reg_sp) = machine_values[:6]
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise Exception('Not a save state, or saved by an incompatible version.')
+
+    chip8.reg_v[:] = reg_v
+    (chip8.reg_i, chip8.reg_pc, chip8.reg_sp) = (reg_i, reg_pc, reg_sp)
+    chip8.stack[:] = machine_values[6:22]
+    chip8.delay_timer.set_value(machine_values[22])
+    chip8.sound_timer.set_value(machine_values[23])
+    chip8.display.rows[:] = machine_values[24:]
+    chip8.display.dirty = True
+    chip8.waiting_for_key = False  # Set again by Fx0A if the restored PC is on one
+
+    _restore_memory(chip8.memory, memoryview(state)[_MACHINE_FORMAT.size:_MACHINE_FORMAT.size + MEMORY_SIZE])
+
+    random_values = _RANDOM_FORMAT.unpack_from(state, _MACHINE_FORMAT.size + MEMORY_SIZE)
+    gauss_next = random_values[626] if random_values[625] else None
+    chip8.random.setstate((3, random_values[:625], gauss_next))
+
+
+def _restore_memory(memory, saved_memory):
+    '''
+    Write back only the chunks of memory that differ, so that caches of unchanged code stay valid.
+    They're restored rather than written, so the program isn't seen writing to them, by watchpoints for instance.
+    '''
+    current_memory = memory.read_data_from_addr(0, MEMORY_SIZE)
+
+    for addr in range(0, MEMORY_SIZE, MEMORY_CHUNK_SIZE):
+        saved_chunk = saved_memory[addr:addr+MEMORY_CHUNK_SIZE]
+        if current_memory[addr:addr+MEMORY_CHUNK_SIZE] != saved_chunk:
+            memory.restore_data_to_addr(saved_chunk, addr)
+
+
+def _xor_bytes(state_a, state_b):
+    '''XOR two states of the same size together.'''
+    return (int.from_bytes(state_a, 'little') ^ int.from_bytes(state_b, 'little')).to_bytes(STATE_SIZE, 'little')
+
+
+class RewindBuffer:
+    '''Ring buffer of per-frame save states that a machine can be rewound through.
+
+    Every keyframe_interval frames a full state is kept as a keyframe, and every other frame is stored
+    as its compressed XOR difference with the last keyframe. Old frames are dropped once the buffer
+    holds capacity frames, along with any keyframe no remaining frame depends on.
+
+    Parameters:
+    chip8: Chip8 instance to record and rewind
+    capacity: maximum number of frames kept
+    keyframe_interval: frames between keyframes
+
+    '''
+    def __init__(self, chip8, capacity=600, keyframe_interval=60):
+        self.chip8 = chip8
+        self.keyframe_interval = keyframe_interval
+
+        self._frames = deque(maxlen=capacity)  # (keyframe, compressed difference or None) pairs
+        self._keyframe = None
+        self._frames_since_keyframe = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def record(self):
+        '''Save the current state of the machine as the newest frame, called once per frame.'''
+        state = save_state(self.chip8)
+
+        if self._keyframe is None or self._frames_since_keyframe >= self.keyframe_interval:
+            self._keyframe = state
+            self._frames_since_keyframe = 0
+            self._frames.append((state, None))
+        else:
+            self._frames.append((self._keyframe, zlib.compress(_xor_bytes(state, self._keyframe), 1)))
+
+        self._frames_since_keyframe += 1
+
+    def rewind(self, frames=1):
+        '''Restore the machine to how it was the given number of recorded frames ago, as far back as the buffer goes.'''
+        if not self._frames:
+            return False
+
+        for _ in range(min(frames, len(self._frames) - 1)):
+            self._frames.pop()
+
+        (keyframe, difference) = self._frames[-1]
+        if difference is None:
+            load_state(self.chip8, keyframe)
+        else:
+            load_state(self.chip8, _xor_bytes(keyframe, zlib.decompress(difference)))
+
+        # The next frame recorded starts a new keyframe, rather than tracking where the last one was
+        self._keyframe = None
+
+        return True
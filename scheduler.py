@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''This module contains the Scheduler class, which paces a Chip-8 machine in 60 Hz frames.'''
+
+import time
+
+
+FRAME_RATE = 60  # Frames per second, also the rate the Chip-8 timers count down at
+FRAME_INTERVAL = 1 / FRAME_RATE
+DEFAULT_CLOCK_SPEED = 600  # Instructions per second
+DEFAULT_SPIN_TIME = 0.001  # Seconds
+MAX_FRAMES_BEHIND = 5  # Frames the host can fall behind before the schedule is reset instead of caught up
+
+
+class Scheduler:
+    '''Runs a Chip-8 machine one frame at a time.
+
+    Every frame it polls the input once, runs a fixed number of instructions, counts the timers down
+    and presents the display once.
+
+    Parameters:
+    chip8: Chip8 instance to run, along with the IOManager attached to it
+    clock_speed: emulated instructions per second
+    throttle: if False, frames run back to back as fast as the host allows
+    spin_time: seconds before every frame deadline that are busy-waited instead of slept, for more accurate pacing
+    rewind_buffer: savestate.RewindBuffer recording every frame, rewound whenever the IOManager requests it
+
+    '''
+    def __init__(self, chip8, clock_speed=DEFAULT_CLOCK_SPEED, throttle=True, spin_time=DEFAULT_SPIN_TIME,
+                 rewind_buffer=None):
+        self.chip8 = chip8
+        self.instructions_per_frame = max(1, round(clock_speed / FRAME_RATE))
+        self.throttle = throttle
+        self.spin_time = spin_time
+        self.rewind_buffer = rewind_buffer
+
+        self._frame_listeners = []
+        if rewind_buffer is not None:
+            self.add_frame_listener(rewind_buffer.record)
+
+        self.frame = 0
+        self.executed = 0  # Skipped idle loop iterations included, since they use up cycles all the same
+        self.skipped = 0  # Instructions in self.executed that were skipped instead of run
+        self._next_frame_time = None
+
+    def run(self, frames=None, cycles=None):
+        '''
+        Run frames until either limit is reached, or forever if both are None, and return the instructions executed,
+        skipped idle loop iterations included.
+        Without a frame limit, the run also ends once the CPU waits for a key that no input can ever press.
+        '''
+        return self.chip8.io_manager.run(lambda: self._main_loop(frames, cycles))
+
+    def add_frame_listener(self, listener):
+        '''Call listener() at the end of every frame the machine runs.'''
+        self._frame_listeners.append(listener)
+
+    def remove_frame_listener(self, listener):
+        '''Stop calling a listener previously added with add_frame_listener.'''
+        self._frame_listeners.remove(listener)
+
+    def run_frame(self, cycles=None):
+        '''Run a single frame, optionally with fewer instructions than usual.'''
+        io_manager = self.chip8.io_manager
+
+        io_manager.poll_input()
+
+        if io_manager.rewind_requested and self.rewind_buffer is not None:
+            # Rewinding replaces the frame, without recording it
+            io_manager.rewind_requested = False
+            self.rewind_buffer.rewind()
+            io_manager.present()
+            return
+
+        if self.chip8.paused:
+            # A paused machine sits whole frames out, timers included, and they aren't counted in self.frame
+            io_manager.present()
+            return
+
+        # A CPU halted on Fx0A sits the frame out, while the timers and the display keep going
+        if not self.chip8.is_halted():
+            skipped_before = self.chip8.skipped
+            self.executed += self.chip8.run(cycles or self.instructions_per_frame)
+            self.skipped += self.chip8.skipped - skipped_before
+        self.chip8.tick_timers()
+        io_manager.present()
+
+        self.frame += 1
+        for listener in self._frame_listeners:
+            listener()
+
+    def _main_loop(self, frames, cycles):
+        '''Run and pace frames until either limit is reached.'''
+        executed_at_start = self.executed
+        frames_run = 0  # Paused and rewound frames included, so that a paused machine still reaches the limit
+
+        while frames is None or frames_run < frames:
+            frame_cycles = None
+            if cycles is not None:
+                frame_cycles = cycles - (self.executed - executed_at_start)
+                if frame_cycles <= 0:
+                    break
+                frame_cycles = min(frame_cycles, self.instructions_per_frame)
+
+            self.run_frame(frame_cycles)
+            frames_run += 1
+
+            # A halted CPU uses no cycles, so the cycle limit alone would never be reached
+            if frames is None and self.chip8.is_halted() and not self.chip8.io_manager.has_pending_input():
+                break
+
+            if self.throttle:
+                self._wait_for_next_frame()
+
+        return self.executed - executed_at_start
+
+    def _wait_for_next_frame(self):
+        '''Sleep until it's time to start the next frame.'''
+        current_time = time.perf_counter()
+
+        if self._next_frame_time is None or current_time - self._next_frame_time > MAX_FRAMES_BEHIND * FRAME_INTERVAL:
+            self._next_frame_time = current_time  # Too far behind to catch up, start counting from now
+        self._next_frame_time += FRAME_INTERVAL
+
+        remaining_time = self._next_frame_time - current_time
+        if remaining_time > self.spin_time:
+            time.sleep(remaining_time - self.spin_time)
+        while time.perf_counter() < self._next_frame_time:
+            pass
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+'''This module hosts Chip-8 sessions for clients that connect over a local socket.'''
+
+import asyncio
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections import deque
+from framebuffer import DISPLAY_HEIGHT
+from iobase import BaseIOManager
+from keypad import KEY_COUNT
+from memorybuffer import MEMORY_SIZE, PROGRAM_START
+from scheduler import Scheduler, DEFAULT_CLOCK_SPEED, FRAME_INTERVAL, FRAME_RATE, MAX_FRAMES_BEHIND
+from vm import Chip8, ENGINES
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8864
+DEFAULT_MAX_SESSIONS = 64
+DEFAULT_ROM_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs')
+MAX_PROGRAM_SIZE = MEMORY_SIZE - PROGRAM_START  # Bytes
+MAX_CLOCK_SPEED = 1000000  # Instructions per second a client can ask for, so that one session can't stall the loop
+MAX_WRITE_BUFFER = 64 * 1024  # Bytes waiting to be sent to a client before its frames are held back
+STATS_WINDOW = FRAME_RATE  # Frames the frame rates are measured over
+SESSION_COMMANDS = ('attach', 'detach', 'key', 'close')  # Commands that act on an existing session
+
+
+def encode_message(message):
+    '''Return a message as a line of JSON.'''
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+def frame_rate(frame_times):
+    '''Return the frames per second measured from a sequence of frame start times.'''
+    if len(frame_times) < 2 or frame_times[-1] == frame_times[0]:
+        return 0.0
+
+    return (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+
+class StreamIOManager(BaseIOManager):
+    '''Input/output manager that sends the display rows that changed to every client attached to a session.
+
+    Every client gets the rows that differ from the ones it was last sent, so a client that attaches
+    late gets the whole display and a client whose connection can't keep up skips frames instead of
+    queueing them. The keypad is driven by the server as key messages arrive.
+
+    Parameters:
+    chip8: Chip8 instance this manager serves
+    session_id: ID of the session, included in every frame message
+
+    '''
+    def __init__(self, chip8, session_id):
+        super().__init__(chip8)
+
+        self.session_id = session_id
+        self.frame = 0
+        self.clients = {}  # Stream writers, mapped to the rows they were last sent
+
+    def run(self, main_loop):
+        '''Call main_loop straight away, since the server paces the frames.'''
+        return main_loop()
+
+    def attach(self, writer):
+        '''Start sending frames to a client, starting with the whole display.'''
+        self.clients[writer] = [None] * DISPLAY_HEIGHT
+        self.chip8.display.dirty = True
+
+    def detach(self, writer):
+        '''Stop sending frames to a client.'''
+        self.clients.pop(writer, None)
+
+    def present(self):
+        '''Send every attached client the rows that changed since it was last sent any.'''
+        self.frame += 1
+        if not self.chip8.display.dirty:
+            return
+
+        rows = self.chip8.display.rows
+        self.chip8.display.dirty = False
+
+        for (writer, sent_rows) in self.clients.items():
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                self.chip8.display.dirty = True  # Try again next frame, in case this client catches up
+                continue
+
+            changed_rows = {coord_y: f'{ row:016x}' for (coord_y, row) in enumerate(rows) if row != sent_rows[coord_y]}
+            if changed_rows:
+                writer.write(encode_message({
+                    'event': 'frame', 'session': self.session_id, 'frame': self.frame, 'rows': changed_rows
+                }))
+                sent_rows[:] = rows
+
+
+class Session:
+    '''A Chip-8 machine hosted by the server.
+
+    Parameters:
+    session_id: ID clients refer to the session by
+    program: Chip-8 binary to run
+    engine: execution engine to run the program on
+    clock_speed: emulated instructions per second
+
+    '''
+    def __init__(self, session_id, program, engine='interpreter', clock_speed=DEFAULT_CLOCK_SPEED):
+        self.session_id = session_id
+        self.chip8 = Chip8(program, engine=engine)
+        self.io_manager = StreamIOManager(self.chip8, session_id)
+        self.scheduler = Scheduler(self.chip8, clock_speed=clock_speed, throttle=False)
+
+        self.frame_times = deque(maxlen=STATS_WINDOW)
+
+    def run_frame(self, current_time):
+        '''Run one frame, started at current_time.'''
+        self.scheduler.run_frame()
+        self.frame_times.append(current_time)
+
+    def stats(self):
+        '''Return a dict with the frame rate and progress of the session.'''
+        return {
+            'frame_rate': round(frame_rate(self.frame_times), 2),
+            'frames': self.scheduler.frame,
+            'instructions': self.scheduler.executed - self.scheduler.skipped,
+            'skipped_instructions': self.scheduler.skipped,
+            'clients': len(self.io_manager.clients)
+        }
+
+
+class Server:
+    '''Runs any number of Chip-8 sessions on one shared 60 Hz frame loop, for clients speaking JSON lines.
+
+    Every message is a JSON object on a line of its own. Clients send commands, and get a reply to each
+    one, echoing its request field if it had one. Frame messages are pushed to every client attached to
+    a session whenever its display changes. Sessions are closed along with the connection that created them.
+
+    Commands:
+    create: start a session from a ROM file under the ROM folder of the server (rom) or a hex string
+            (program), optionally with an engine and a clock speed, and attach to it
+    attach, detach: start or stop getting the frames of a session
+    key: press or release a key of a session (key, pressed)
+    close: close a session
+    stats: get the frame rate of the loop and of every session
+
+    Parameters:
+    max_sessions: sessions that can run at the same time
+    rom_directory: folder clients can load ROM files from, subfolders included
+
+    '''
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, rom_directory=DEFAULT_ROM_DIRECTORY):
+        self.max_sessions = max_sessions
+        self.rom_directory = os.path.realpath(rom_directory)
+        self.sessions = {}
+        self._next_session_id = 1
+
+        self.frame_times = deque(maxlen=STATS_WINDOW)
+        self.frame_host_times = deque(maxlen=STATS_WINDOW)  # Seconds spent running each frame of every session
+
+    async def serve_tcp(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        '''Serve clients on a TCP socket until cancelled.'''
+        await self._serve(await asyncio.start_server(self._handle_client, host, port))
+
+    async def serve_unix(self, path):
+        '''Serve clients on a Unix socket until cancelled.'''
+        await self._serve(await asyncio.start_unix_server(self._handle_client, path))
+
+    def stats(self):
+        '''Return a dict with the frame rate of the loop, the time it spends running frames and the rate of every session.'''
+        sessions = {session_id: session.stats() for (session_id, session) in self.sessions.items()}
+        host_times = self.frame_host_times
+
+        return {
+            'frame_rate': round(frame_rate(self.frame_times), 2),
+            'frame_host_ms': round(sum(host_times) / len(host_times) * 1000, 3) if host_times else 0.0,
+            'aggregate_frame_rate': round(sum(session['frame_rate'] for session in sessions.values()), 2),
+            'sessions': sessions
+        }
+
+    async def _serve(self, server):
+        '''Run the frame loop alongside a started asyncio server.'''
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._frame_loop())
+
+    async def _frame_loop(self):
+        '''Run a frame of every session 60 times per second.'''
+        loop = asyncio.get_running_loop()
+        next_frame_time = loop.time()
+
+        while True:
+            start_time = time.perf_counter()
+            self.frame_times.append(start_time)
+
+            for session in list(self.sessions.values()):
+                try:
+                    session.run_frame(start_time)
+                except Exception as error:
+                    self._close_session(session.session_id, f'{ type(error).__name__ }: { error }')
+
+            self.frame_host_times.append(time.perf_counter() - start_time)
+
+            # Same pacing as Scheduler, with the waiting left to the event loop so clients are served in between
+            current_time = loop.time()
+            if current_time - next_frame_time > MAX_FRAMES_BEHIND * FRAME_INTERVAL:
+                next_frame_time = current_time
+            next_frame_time += FRAME_INTERVAL
+            await asyncio.sleep(max(0.0, next_frame_time - current_time))
+
+    async def _handle_client(self, reader, writer):
+        '''Serve the commands of one client until it disconnects.'''
+        connection = {'writer': writer, 'created': set(), 'attached': set()}
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                request = None
+                try:
+                    message = json.loads(line)
+                    request = message.get('request')
+                    reply = self._handle_command(connection, message)
+                except Exception as error:
+                    reply = {'event': 'error', 'message': str(error)}
+
+                if request is not None:
+                    reply['request'] = request
+                writer.write(encode_message(reply))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in connection['attached']:
+                if session_id in self.sessions:
+                    self.sessions[session_id].io_manager.detach(writer)
+            for session_id in connection['created']:
+                self._close_session(session_id)
+            writer.close()
+
+    def _handle_command(self, connection, message):
+        '''Run a command from a client and return the reply.'''
+        command = message.get('command')
+
+        if command == 'create':
+            return self._create_session(connection, message)
+        elif command == 'stats':
+            return {'event': 'stats', **self.stats()}
+        elif command not in SESSION_COMMANDS:
+            raise Exception(f'Unknown command { command }.')
+
+        session = self.sessions.get(message.get('session'))
+        if session is None:
+            raise Exception(f'Unknown session { message.get("session") }.')
+
+        if command == 'attach':
+            session.io_manager.attach(connection['writer'])
+            connection['attached'].add(session.session_id)
+        elif command == 'detach':
+            session.io_manager.detach(connection['writer'])
+            connection['attached'].discard(session.session_id)
+        elif command == 'key':
+            key = message.get('key')
+            if not isinstance(key, int) or not 0 <= key < KEY_COUNT:
+                raise Exception(f'Keys go from 0 to { KEY_COUNT - 1 }.')
+            if message.get('pressed', True):
+                session.chip8.keypad.press(key)
+            else:
+                session.chip8.keypad.release(key)
+        else:  # close
+            self._close_session(session.session_id)
+            connection['created'].discard(session.session_id)
+
+        return {'event': 'ok', 'session': session.session_id}
+
+    def _create_session(self, connection, message):
+        '''Start a session for a client, attach the client to it and return the reply.'''
+        if len(self.sessions) >= self.max_sessions:
+            raise Exception(f'No more than { self.max_sessions } sessions can run at once.')
+
+        if 'rom' in message:
+            program = self._read_rom(message['rom'])
+        else:
+            program = bytes.fromhex(message['program'])
+        if len(program) > MAX_PROGRAM_SIZE:
+            raise Exception(f'Programs can be no larger than { MAX_PROGRAM_SIZE } bytes.')
+
+        engine = message.get('engine', 'interpreter')
+        if engine not in ENGINES:
+            raise Exception(f'Unknown engine { engine }.')
+
+        clock_speed = message.get('clock', DEFAULT_CLOCK_SPEED)
+        if isinstance(clock_speed, bool) or not isinstance(clock_speed, (int, float)) or not 0 < clock_speed <= MAX_CLOCK_SPEED:
+            raise Exception(f'Clock speeds go up to { MAX_CLOCK_SPEED } instructions per second.')
+
+        session_id = self._next_session_id
+        self._next_session_id += 1
+        session = Session(session_id, program, engine, clock_speed)
+        self.sessions[session_id] = session
+
+        connection['created'].add(session_id)
+        connection['attached'].add(session_id)
+        session.io_manager.attach(connection['writer'])
+
+        return {'event': 'created', 'session': session_id}
+
+    def _read_rom(self, rom):
+        '''Return the start of a ROM file under the ROM folder, one byte past the largest program at most.'''
+        # The file is read on the event loop, so it has to be a small regular file in a folder the server chose
+        rom_path = os.path.realpath(os.path.join(self.rom_directory, rom))
+        if os.path.commonpath([rom_path, self.rom_directory]) != self.rom_directory or not os.path.isfile(rom_path):
+            raise Exception(f'No ROM { rom } in the ROM folder.')
+
+        with open(rom_path, 'rb') as rom_file:
+            return rom_file.read(MAX_PROGRAM_SIZE + 1)
+
+    def _close_session(self, session_id, error=None):
+        '''Stop running a session and tell its clients, along with the error that stopped it if any.'''
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+
+        message = encode_message({'event': 'closed', 'session': session_id, 'error': error})
+        for writer in session.io_manager.clients:
+            writer.write(message)
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Host Chip-8 sessions for clients on a local socket.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'address to listen on (default { DEFAULT_HOST })')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'TCP port to listen on (default { DEFAULT_PORT })')
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket at PATH instead of TCP')
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS,
+                        help=f'sessions that can run at the same time (default { DEFAULT_MAX_SESSIONS })')
+    parser.add_argument('--rom-directory', metavar='DIR', default=DEFAULT_ROM_DIRECTORY,
+                        help='folder clients can load ROM files from (default: the bundled programs)')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGUMENTS = parse_arguments()
+    SERVER = Server(ARGUMENTS.max_sessions, ARGUMENTS.rom_directory)
+
+    try:
+        if ARGUMENTS.unix:
+            asyncio.run(SERVER.serve_unix(ARGUMENTS.unix))
+        else:
+            asyncio.run(SERVER.serve_tcp(ARGUMENTS.host, ARGUMENTS.port))
+    except KeyboardInterrupt:
+        pass
@@ -5,9 +5,29 @@ import threading
 import time
 
 
-class Timer(threading.Thread):
+class Timer:
+    '''Chip-8 timer, counted down once per emulated frame by whatever runs the machine.'''
     def __init__(self):
-        super(Timer, self).__init__(daemon=True)
+        self.value = 0
+
+    def tick(self):
+        '''Reduce the timer\'s value by 1, unless it already reached 0.'''
+        if self.value > 0:
+            self.value -= 1
+
+    def set_value(self, new_value):
+        '''Set the value of the timer to new_value.'''
+        self.value = new_value
+
+    def get_value(self):
+        '''Get the value of the timer'''
+        return self.value
+
+
+class ThreadedTimer(threading.Thread):
+    '''Chip-8 timer that counts itself down in its own thread, following the host\'s clock.'''
+    def __init__(self):
+        super(ThreadedTimer, self).__init__(daemon=True)
 
         self.value = 0
         self._value_lock = threading.Lock()
@@ -23,6 +43,10 @@ class Timer(threading.Thread):
             self._next_countdown_call += 0.017
             time.sleep(max(self._next_countdown_call - time.time(), 0))
 
+    def tick(self):
+        '''Do nothing, the timer\'s own thread counts it down.'''
+        pass
+
     def set_value(self, new_value):
         '''Set the value of the timer to new_value.'''
         with self._value_lock:
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''This module contains the BlockTranslator class, an execution engine that compiles Chip-8 code into Python.'''
+
+from memorybuffer import MEMORY_SIZE
+from vm import ExecutionHalted, IdleLoop, UnknownInstructionError, find_idle_loop
+
+
+MAX_BLOCK_LENGTH = 64  # Instructions
+
+
+def is_block_terminator(instruction):
+    '''Return True if instruction can move the PC anywhere other than the next instruction.'''
+    instruction_category = (instruction & 0xF000) >> 12
+
+    if instruction_category in (0x1, 0x2, 0x3, 0x4, 0x5, 0x9, 0xB, 0xE):
+        return True
+    if instruction_category == 0x0:
+        return instruction != 0x00E0
+    if instruction_category == 0xF:
+        # Memory writes end the block too, in case they overwrite the block itself
+        return instruction & 0x00FF in (0x0A, 0x33, 0x55)
+
+    return False
+
+
+def can_halt(instruction):
+    '''Return True if instruction can halt the CPU, like Fx0A waiting for a key.'''
+    return instruction & 0xF0FF == 0xF00A
+
+
+def _register(arg):
+    '''Name of the local variable a register is lowered to.'''
+    return f'v{ arg:x}'
+
+
+class BlockTranslator:
+    '''Execution engine that runs Chip-8 programs one compiled basic block at a time.
+
+    Parameters:
+    chip8: Chip8 instance whose state the compiled blocks operate on
+
+    '''
+    def __init__(self, chip8):
+        self.chip8 = chip8
+
+        # Compiled blocks, indexed by the address of their first instruction
+        self._blocks = [None] * MEMORY_SIZE
+        # Instructions run by each of those blocks, which always run to the end
+        self._block_lengths = [0] * MEMORY_SIZE
+        # Start addresses of the blocks that contain each address
+        self._covering_blocks = [None] * MEMORY_SIZE
+        # Addresses that were overwritten after being compiled, which are always interpreted from then on
+        self._self_modified = bytearray(MEMORY_SIZE)
+
+        chip8.memory.add_write_listener(self._invalidate)
+        chip8.memory.add_restore_listener(self._forget)
+
+    def run(self, cycles):
+        '''Execute the given number of instructions, stopping early if the CPU halts, and return how many were executed, like Chip8.run.'''
+        chip8 = self.chip8
+        blocks = self._blocks
+        block_lengths = self._block_lengths
+        executed = 0
+
+        while executed < cycles:
+            try:
+                while executed < cycles:
+                    block = blocks[chip8.reg_pc]
+                    if block is None:
+                        block = self._translate(chip8.reg_pc)
+                    if executed + block_lengths[chip8.reg_pc] > cycles:
+                        block = _interpret_instruction  # Blocks can't stop halfway, so the rest is run one at a time
+                    executed += block(chip8)
+            except ExecutionHalted:
+                break  # Only ever raised by a block of its own, so none of it had run
+            except IdleLoop as idle_loop:
+                # Also raised by a block of its own, after its jump has run
+                executed += 1 + chip8.skip_idle_iterations(idle_loop, cycles - executed - 1)
+
+        return executed
+
+    def _invalidate(self, addr, n_bytes):
+        '''Drop every compiled block containing any of the n bytes written at addr.'''
+        for written_addr in range(addr, addr + n_bytes):
+            if self._covering_blocks[written_addr]:
+                self._self_modified[written_addr] = 1
+                self._drop_covering_blocks(written_addr)
+
+    def _forget(self, addr, n_bytes):
+        '''Drop every compiled block containing any of the n bytes restored at addr, which can be compiled again.'''
+        # Restored code is back to how it was at some point, not overwritten by the program
+        for restored_addr in range(addr, addr + n_bytes):
+            self._self_modified[restored_addr] = 0
+            self._blocks[restored_addr] = None
+            if self._covering_blocks[restored_addr]:
+                self._drop_covering_blocks(restored_addr)
+
+    def _drop_covering_blocks(self, addr):
+        '''Drop every compiled block containing addr.'''
+        for block_start in self._covering_blocks[addr]:
+            self._blocks[block_start] = None
+        self._covering_blocks[addr] = None
+
+    def _translate(self, start):
+        '''Compile the basic block starting at start and cache it.'''
+        memory = self.chip8.memory
+        instructions = []
+        addr = start
+
+        while len(instructions) < MAX_BLOCK_LENGTH and addr + 1 < MEMORY_SIZE:
+            if self._self_modified[addr] or self._self_modified[addr + 1]:
+                break
+
+            instruction = memory.read_word_from_addr(addr)
+            if can_halt(instruction) or (self.chip8.skip_idle_loops and find_idle_loop(memory, addr)):
+                break  # Left to the interpreter in a block of its own, so that halting never stops a block halfway
+
+            try:
+                handler = self.chip8.decode_instruction(instruction)
+            except UnknownInstructionError:
+                break  # Let the interpreter raise the error if this instruction is ever reached
+
+            instructions.append((addr, instruction, handler))
+            addr += 2
+
+            if is_block_terminator(instruction):
+                break
+
+        if not instructions:
+            # Overwritten code, halting instructions, idle loop jumps and invalid instructions are left to the interpreter
+            self._blocks[start] = _interpret_instruction
+            self._block_lengths[start] = 1
+            return _interpret_instruction
+
+        block = self._compile(start, instructions)
+        self._blocks[start] = block
+        self._block_lengths[start] = len(instructions)
+        for covered_addr in range(start, addr):
+            if self._covering_blocks[covered_addr] is None:
+                self._covering_blocks[covered_addr] = []
+            self._covering_blocks[covered_addr].append(start)
+
+        return block
+
+    def _compile(self, start, instructions):
+        '''Generate and compile the Python function for a list of (addr, instruction, handler) tuples.'''
+        namespace = {}
+        body = []
+        used_registers = set()
+        written_registers = set()
+
+        for (index, (addr, instruction, handler)) in enumerate(instructions):
+            lowered = _lower_instruction(instruction, addr)
+
+            if lowered is None:
+                # Anything not lowered is run through the interpreter, with the registers synced around it
+                namespace[f'h{ index }'] = handler
+                body.append(('sync_out', None))
+                body.append(('line', f'chip8.reg_pc = { addr }'))
+                body.append(('line', f'h{ index }()'))
+                if is_block_terminator(instruction):
+                    body.append(('line', 'chip8.reg_pc += 2'))
+                if index < len(instructions) - 1:
+                    body.append(('sync_in', None))
+            else:
+                (lines, read, written) = lowered
+                used_registers |= read | written
+                written_registers |= written
+                body += [('line', line) for line in lines]
+                if index == len(instructions) - 1:
+                    body.append(('sync_out', None))
+
+        (last_addr, last_instruction, _) = instructions[-1]
+        if not is_block_terminator(last_instruction):
+            body.append(('line', f'chip8.reg_pc = { last_addr + 2 }'))
+
+        registers = sorted(used_registers)
+        source = [f'def block_{ start:03X}(chip8):', '    v = chip8.reg_v']
+        source += [f'    { _register(reg) } = v[{ reg }]' for reg in registers]
+        for (kind, line) in body:
+            if kind == 'line':
+                source.append(f'    { line }')
+            elif kind == 'sync_out':
+                source += [f'    v[{ reg }] = { _register(reg) }' for reg in sorted(written_registers)]
+            elif kind == 'sync_in':
+                source += [f'    { _register(reg) } = v[{ reg }]' for reg in registers]
+        source.append(f'    return { len(instructions) }')
+
+        exec(compile('\n'.join(source), f'<chip8 block { start:03X}>', 'exec'), namespace)
+        return namespace[f'block_{ start:03X}']
+
+
+def _interpret_instruction(chip8):
+    '''Fallback block that runs a single instruction through the interpreter.'''
+    chip8.step()
+    return 1
+
+
+def _lower_instruction(instruction, addr):
+    '''
+    Return the Python source lines for an instruction with its registers lowered to locals,
+    along with the registers it reads and writes, or None if it has to go through the interpreter.
+    '''
+    instruction_category = (instruction & 0xF000) >> 12
+    arg_nnn = instruction & 0x0FFF
+    arg_x = (instruction & 0x0F00) >> 8
+    arg_y = (instruction & 0x00F0) >> 4
+    arg_n = instruction & 0x000F
+    arg_kk = instruction & 0x00FF
+    (v_x, v_y, v_f) = (_register(arg_x), _register(arg_y), _register(0xF))
+
+    if instruction_category == 0x1:
+        return ([f'chip8.reg_pc = { arg_nnn }'], set(), set())
+    elif instruction_category == 0x3:
+        return ([f'chip8.reg_pc = { addr + 4 } if { v_x } == { arg_kk } else { addr + 2 }'], {arg_x}, set())
+    elif instruction_category == 0x4:
+        return ([f'chip8.reg_pc = { addr + 4 } if { v_x } != { arg_kk } else { addr + 2 }'], {arg_x}, set())
+    elif instruction_category == 0x5:
+        return ([f'chip8.reg_pc = { addr + 4 } if { v_x } == { v_y } else { addr + 2 }'], {arg_x, arg_y}, set())
+    elif instruction_category == 0x6:
+        return ([f'{ v_x } = { arg_kk }'], set(), {arg_x})
+    elif instruction_category == 0x7:
+        return ([
+            f'{ v_x } += { arg_kk }',
+            f'if { v_x } >= 256:',
+            f'    { v_x } %= 256',
+            f'    { v_f } = 1',
+            'else:',
+            f'    { v_f } = 0'
+        ], {arg_x}, {arg_x, 0xF})
+    elif instruction_category == 0x8:
+        return _lower_instruction_8(arg_x, arg_y, arg_n)
+    elif instruction_category == 0x9:
+        # Mirrors the interpreter, which compares the register numbers themselves
+        return ([f'chip8.reg_pc = { addr + 4 if arg_x != arg_y else addr + 2 }'], set(), set())
+    elif instruction_category == 0xA:
+        return ([f'chip8.reg_i = { arg_nnn }'], set(), set())
+    elif instruction_category == 0xF and arg_kk == 0x1E:
+        return ([f'chip8.reg_i += { v_x }'], {arg_x}, set())
+    elif instruction_category == 0xF and arg_kk == 0x29:
+        return ([f'chip8.reg_i = { arg_x * 5 }'], set(), set())
+
+    return None
+
+
+def _lower_instruction_8(arg_x, arg_y, arg_n):
+    '''Lower 8xy[0-7] and 8xyE, following the interpreter statement by statement.'''
+    (v_x, v_y, v_f) = (_register(arg_x), _register(arg_y), _register(0xF))
+
+    if arg_n == 0x0:
+        lines = [f'{ v_x } = { v_y }']
+    elif arg_n == 0x1:
+        lines = [f'{ v_x } |= { v_y }']
+    elif arg_n == 0x2:
+        lines = [f'{ v_x } &= { v_y }']
+    elif arg_n == 0x3:
+        lines = [f'{ v_x } ^= { v_y }']
+    elif arg_n == 0x4:
+        lines = [
+            f'{ v_x } += { v_y }',
+            f'if { v_x } >= 256:',
+            f'    { v_x } %= 256',
+            f'    { v_f } = 1',
+            'else:',
+            f'    { v_f } = 0'
+        ]
+    elif arg_n == 0x5:
+        lines = [
+            f'{ v_f } = 1 if { v_x } > { v_y } else 0',
+            f'{ v_x } = ({ v_x } - { v_y }) % 256'
+        ]
+    elif arg_n == 0x6:
+        lines = [
+            f'{ v_f } = { v_y } % 2',
+            f'{ v_x } = { v_y } >> 1'
+        ]
+    elif arg_n == 0x7:
+        lines = [
+            f'{ v_f } = 1 if { v_y } > { v_x } else 0',
+            f'{ v_x } = ({ v_y } - { v_x }) % 256'
+        ]
+    else:  # 0xE, anything else fails to decode before getting here
+        lines = [
+            f'{ v_f } = { v_y } % 2',
+            f'{ v_x } = ({ v_y } << 1) & 0xFF'
+        ]
+
+    written = {arg_x}
+    if arg_n in (0x4, 0x5, 0x6, 0x7, 0xE):
+        written.add(0xF)
+
+    return (lines, {arg_x, arg_y}, written)
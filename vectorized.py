@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+'''This module contains the VectorChip8 class, which runs many Chip-8 machines in lockstep using NumPy.'''
+
+import time
+from argparse import ArgumentParser
+from framebuffer import DISPLAY_WIDTH, DISPLAY_HEIGHT
+from keypad import KEY_COUNT
+from memorybuffer import MemoryBuffer, MEMORY_SIZE, PROGRAM_START
+from scheduler import FRAME_RATE, DEFAULT_CLOCK_SPEED
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class VectorChip8:
+    '''Many emulated Chip-8 machines running the same program, one instruction per machine per step.
+
+    The state of every machine is stored along the first axis of NumPy arrays, and every step runs each
+    group of machines sitting on the same kind of instruction through a single masked update.
+    Instructions behave exactly like in vm.Chip8, quirks included, except for Cxkk, which draws from
+    NumPy's generator. Fx0A leaves the PC in place until a key that wasn't held when it started waiting goes
+    down, without holding up the other machines.
+    A machine that raises an error in vm.Chip8 is marked as crashed here and stops running.
+
+    Parameters:
+    program: Chip-8 binary as a bytes-like object
+    n_machines: how many machines to run
+    seed: seed for the random number generator shared by all the machines
+
+    '''
+    def __init__(self, program, n_machines, seed=None):
+        if np is None:
+            raise Exception('VectorChip8 needs NumPy, install it with "pip install numpy".')
+
+        self.n_machines = n_machines
+
+        # Memory buffers, all starting out as copies of the same one
+        self.memory = np.empty((n_machines, MEMORY_SIZE), dtype=np.uint8)
+        self.memory[:] = np.frombuffer(bytes(MemoryBuffer(program).memory), dtype=np.uint8)
+
+        # Registers
+        self.reg_v = np.zeros((n_machines, 16), dtype=np.uint8)
+        self.reg_i = np.zeros(n_machines, dtype=np.int64)
+
+        # Pseudo-registers
+        self.reg_pc = np.full(n_machines, PROGRAM_START, dtype=np.int64)
+        self.reg_sp = np.zeros(n_machines, dtype=np.int64)
+
+        # Timers
+        self.delay_timer = np.zeros(n_machines, dtype=np.int64)
+        self.sound_timer = np.zeros(n_machines, dtype=np.int64)
+
+        # Stack
+        self.stack = np.zeros((n_machines, 16), dtype=np.int64)
+
+        # Display, one 64-bit integer per row like framebuffer.FrameBuffer, and keypad
+        self.display = np.zeros((n_machines, DISPLAY_HEIGHT), dtype=np.uint64)
+        self.keypad = np.zeros((n_machines, KEY_COUNT), dtype=bool)
+
+        # Machines halted on Fx0A, and the keys they had held when they started waiting, which can't end the wait
+        self.waiting_for_key = np.zeros(n_machines, dtype=bool)
+        self.keys_held_at_wait = np.zeros((n_machines, KEY_COUNT), dtype=bool)
+
+        # Machines that raised an error, and the error they raised
+        self.crashed = np.zeros(n_machines, dtype=bool)
+        self.errors = [None] * n_machines
+
+        self._random_generator = np.random.default_rng(seed)
+        self._live_machines = np.arange(n_machines)
+
+        # Opcode categories
+        self._instruction_lookup = [
+            self._instruction_0,
+            self._instruction_1,
+            self._instruction_2,
+            self._instruction_3,
+            self._instruction_4,
+            self._instruction_5,
+            self._instruction_6,
+            self._instruction_7,
+            self._instruction_8,
+            self._instruction_9,
+            self._instruction_A,
+            self._instruction_B,
+            self._instruction_C,
+            self._instruction_D,
+            self._instruction_E,
+            self._instruction_F
+        ]
+
+    def step(self):
+        '''Run one instruction on every machine that hasn't crashed and return how many were run, not counting waits on Fx0A.'''
+        machines = self._live_machines
+        pc = self.reg_pc[machines]
+
+        out_of_memory = (pc < 0) | (pc + 1 >= MEMORY_SIZE)
+        if out_of_memory.any():
+            self._crash(machines[out_of_memory], 'PC out of memory.')
+            (machines, pc) = (machines[~out_of_memory], pc[~out_of_memory])
+
+        instruction = (self.memory[machines, pc].astype(np.int64) << 8) | self.memory[machines, pc + 1]
+        instruction_category = instruction >> 12
+
+        for category in np.unique(instruction_category):
+            selected = instruction_category == category
+            self.reg_pc[machines[selected]] = self._instruction_lookup[category](
+                machines[selected], instruction[selected], pc[selected]
+            )
+
+        # Machines that crashed during this step stay on the instruction that crashed them
+        crashed_now = self.crashed[machines]
+        if crashed_now.any():
+            self.reg_pc[machines[crashed_now]] = pc[crashed_now]
+            self._live_machines = np.flatnonzero(~self.crashed)
+
+        # Like vm.Chip8.run, an Fx0A that leaves the machine waiting isn't counted as run
+        return len(machines) - int(np.count_nonzero(self.waiting_for_key[machines]))
+
+    def run(self, cycles):
+        '''Run the given number of steps and return how many instructions were run across all machines.'''
+        executed = 0
+        for _ in range(cycles):
+            executed += self.step()
+
+        return executed
+
+    def tick_timers(self):
+        '''Count the timers of every machine down, called once per emulated frame.'''
+        np.maximum(self.delay_timer - 1, 0, out=self.delay_timer)
+        np.maximum(self.sound_timer - 1, 0, out=self.sound_timer)
+
+    def run_frame(self, instructions_per_frame):
+        '''Run one emulated frame and return how many instructions were run across all machines.'''
+        executed = self.run(instructions_per_frame)
+        self.tick_timers()
+
+        return executed
+
+    def _crash(self, machines, message):
+        '''Mark the given machines as crashed with the given error message.'''
+        self.crashed[machines] = True
+        for machine in machines:
+            self.errors[machine] = message
+
+    # Opcode implementations, each taking the machines running it, their instructions and their PCs,
+    # and returning the PCs they move on to
+    def _instruction_0(self, machines, instruction, pc):
+        '''Instructions 00E0 [CLS], 00EE [RET] and 0nnn [SYS addr].'''
+        next_pc = pc + 2
+
+        clear = instruction == 0x00E0
+        self.display[machines[clear]] = 0
+
+        ret = instruction == 0x00EE
+        empty_stack = ret & (self.reg_sp[machines] == 0)
+        self._crash(machines[empty_stack], 'Empty Stack')
+        ret &= ~empty_stack
+        self.reg_sp[machines[ret]] -= 1
+        next_pc[ret] = self.stack[machines[ret], self.reg_sp[machines[ret]]] + 2
+
+        sys = ~(clear | (instruction == 0x00EE))
+        next_pc[sys] = (instruction[sys] & 0x0FFF) + 2
+
+        return next_pc
+
+    def _instruction_1(self, machines, instruction, pc):
+        '''Instruction 1nnn [JP addr].'''
+        return instruction & 0x0FFF
+
+    def _instruction_2(self, machines, instruction, pc):
+        '''Instruction 2nnn [CALL addr].'''
+        full_stack = self.reg_sp[machines] == 0xF
+        self._crash(machines[full_stack], 'Full stack.')
+
+        calling = machines[~full_stack]
+        self.stack[calling, self.reg_sp[calling]] = pc[~full_stack]
+        self.reg_sp[calling] += 1
+
+        return (instruction & 0x0FFF) + 2  # vm.Chip8 doesn't rewind the PC before it moves to the next instruction
+
+    def _instruction_3(self, machines, instruction, pc):
+        '''Instruction 3xkk [SE Vx, byte].'''
+        reg_x = self.reg_v[machines, (instruction >> 8) & 0xF]
+        return pc + np.where(reg_x == (instruction & 0xFF), 4, 2)
+
+    def _instruction_4(self, machines, instruction, pc):
+        '''Instruction 4xkk [SNE Vx, byte].'''
+        reg_x = self.reg_v[machines, (instruction >> 8) & 0xF]
+        return pc + np.where(reg_x != (instruction & 0xFF), 4, 2)
+
+    def _instruction_5(self, machines, instruction, pc):
+        '''Instruction 5xy0 [SE Vx, Vy].'''
+        reg_x = self.reg_v[machines, (instruction >> 8) & 0xF]
+        reg_y = self.reg_v[machines, (instruction >> 4) & 0xF]
+        return pc + np.where(reg_x == reg_y, 4, 2)
+
+    def _instruction_6(self, machines, instruction, pc):
+        '''Instruction 6xkk [LD Vx, byte].'''
+        self.reg_v[machines, (instruction >> 8) & 0xF] = instruction & 0xFF
+        return pc + 2
+
+    def _instruction_7(self, machines, instruction, pc):
+        '''Instruction 7xkk [ADD Vx, byte].'''
+        arg_x = (instruction >> 8) & 0xF
+        total = self.reg_v[machines, arg_x].astype(np.int64) + (instruction & 0xFF)
+
+        self.reg_v[machines, arg_x] = total & 0xFF
+        self.reg_v[machines, 0xF] = total >= 256
+
+        return pc + 2
+
+    def _instruction_8(self, machines, instruction, pc):
+        '''Instructions 8xy[0-7] and 8xyE.'''
+        arg_n = instruction & 0xF
+        reg_v = self.reg_v
+
+        for n_value in np.unique(arg_n):
+            selected = arg_n == n_value
+            group = machines[selected]
+            arg_x = (instruction[selected] >> 8) & 0xF
+            arg_y = (instruction[selected] >> 4) & 0xF
+
+            # The registers are read again after every write, in case x or y is F
+            if n_value == 0x0:
+                reg_v[group, arg_x] = reg_v[group, arg_y]
+            elif n_value == 0x1:
+                reg_v[group, arg_x] |= reg_v[group, arg_y]
+            elif n_value == 0x2:
+                reg_v[group, arg_x] &= reg_v[group, arg_y]
+            elif n_value == 0x3:
+                reg_v[group, arg_x] ^= reg_v[group, arg_y]
+            elif n_value == 0x4:
+                total = reg_v[group, arg_x].astype(np.int64) + reg_v[group, arg_y]
+                reg_v[group, arg_x] = total & 0xFF
+                reg_v[group, 0xF] = total >= 256
+            elif n_value == 0x5:
+                reg_v[group, 0xF] = reg_v[group, arg_x] > reg_v[group, arg_y]
+                reg_v[group, arg_x] = (reg_v[group, arg_x].astype(np.int64) - reg_v[group, arg_y]) % 256
+            elif n_value == 0x6:
+                reg_v[group, 0xF] = reg_v[group, arg_y] % 2
+                reg_v[group, arg_x] = reg_v[group, arg_y] >> 1
+            elif n_value == 0x7:
+                reg_v[group, 0xF] = reg_v[group, arg_y] > reg_v[group, arg_x]
+                reg_v[group, arg_x] = (reg_v[group, arg_y].astype(np.int64) - reg_v[group, arg_x]) % 256
+            elif n_value == 0xE:
+                reg_v[group, 0xF] = reg_v[group, arg_y] % 2
+                reg_v[group, arg_x] = (reg_v[group, arg_y].astype(np.int64) << 1) & 0xFF
+            else:
+                self._crash(group, '8xyX instruction not recognised.')
+
+        return pc + 2
+
+    def _instruction_9(self, machines, instruction, pc):
+        '''Instruction 9xy0 [SNE Vx, Vy].'''
+        # Compares the register numbers themselves, like vm.Chip8
+        return pc + np.where(((instruction >> 8) & 0xF) != ((instruction >> 4) & 0xF), 4, 2)
+
+    def _instruction_A(self, machines, instruction, pc):
+        '''Instruction Annn [LD I, addr].'''
+        self.reg_i[machines] = instruction & 0x0FFF
+        return pc + 2
+
+    def _instruction_B(self, machines, instruction, pc):
+        '''Instruction Bnnn [JP V0, addr].'''
+        return self.reg_v[machines, 0].astype(np.int64) + (instruction & 0x0FFF) + 2
+
+    def _instruction_C(self, machines, instruction, pc):
+        '''Instruction Cxkk [RND Vx, byte].'''
+        random_bytes = self._random_generator.integers(0, 256, len(machines))
+        self.reg_v[machines, (instruction >> 8) & 0xF] = random_bytes & instruction & 0xFF
+        return pc + 2
+
+    def _instruction_D(self, machines, instruction, pc):
+        '''Instruction Dxyn [DRW Vx, Vy, nibble].'''
+        pos_x = self.reg_v[machines, (instruction >> 8) & 0xF].astype(np.int64) % DISPLAY_WIDTH
+        pos_y = self.reg_v[machines, (instruction >> 4) & 0xF].astype(np.int64) % DISPLAY_HEIGHT
+        arg_n = instruction & 0xF
+        reg_i = self.reg_i[machines]
+
+        shift = DISPLAY_WIDTH - 8 - pos_x
+        wraps = shift < 0
+        left_shift = np.where(wraps, 0, shift).astype(np.uint64)
+        right_shift = np.where(wraps, -shift, 0).astype(np.uint64)
+        wrapped_shift = np.where(wraps, DISPLAY_WIDTH + shift, 0).astype(np.uint64)
+        collision = np.zeros(len(machines), dtype=bool)
+
+        for row_number in range(int(arg_n.max(initial=0))):
+            # Rows past the end of memory aren't drawn, like the truncated read in vm.Chip8
+            drawing = (arg_n > row_number) & (reg_i + row_number < MEMORY_SIZE)
+            group = machines[drawing]
+            sprite_row = self.memory[group, reg_i[drawing] + row_number].astype(np.uint64)
+
+            # Values of uint64 drop whatever is shifted past bit 63, which rotates the wrapped part for free
+            sprite_bits = np.where(
+                wraps[drawing],
+                (sprite_row >> right_shift[drawing]) | (sprite_row << wrapped_shift[drawing]),
+                sprite_row << left_shift[drawing]
+            )
+
+            coord_y = (pos_y[drawing] + row_number) % DISPLAY_HEIGHT
+            displayed = self.display[group, coord_y]
+            collision[drawing] |= (displayed & sprite_bits) != 0
+            self.display[group, coord_y] = displayed ^ sprite_bits
+
+        self.reg_v[machines, 0xF] = collision
+
+        return pc + 2
+
+    def _instruction_E(self, machines, instruction, pc):
+        '''Instructions Ex9E [SKP Vx] and ExA1 [SKNP Vx].'''
+        arg_kk = instruction & 0xFF
+        key = self.reg_v[machines, (instruction >> 8) & 0xF]
+        # Registers can hold values past the last key, which are never pressed
+        valid_key = key < KEY_COUNT
+        pressed = valid_key & self.keypad[machines, np.where(valid_key, key, 0)]
+
+        skip_if_pressed = arg_kk == 0x9E
+        skip_if_not_pressed = arg_kk == 0xA1
+        self._crash(machines[~(skip_if_pressed | skip_if_not_pressed)], 'ExXX instruction not recognised.')
+
+        skip = (skip_if_pressed & pressed) | (skip_if_not_pressed & ~pressed)
+        return pc + np.where(skip, 4, 2)
+
+    def _instruction_F(self, machines, instruction, pc):
+        '''Instructions Fx07, Fx0A, Fx15, Fx18, Fx1E, Fx29, Fx33, Fx55 and Fx65.'''
+        next_pc = pc + 2
+        arg_kk = instruction & 0xFF
+        reg_v = self.reg_v
+
+        for kk_value in np.unique(arg_kk):
+            selected = arg_kk == kk_value
+            group = machines[selected]
+            arg_x = (instruction[selected] >> 8) & 0xF
+            reg_i = self.reg_i[group]
+
+            if kk_value == 0x07:
+                reg_v[group, arg_x] = self.delay_timer[group]
+            elif kk_value == 0x0A:
+                keypad = self.keypad[group]
+                keys_held_at_wait = self.keys_held_at_wait[group]
+                starting = ~self.waiting_for_key[group]
+                keys_held_at_wait[starting] = keypad[starting]
+                keys_held_at_wait &= keypad  # A key released since counts as new the next time it goes down
+                new_keys = keypad & ~keys_held_at_wait
+                any_new = new_keys.any(axis=1)
+
+                reg_v[group[any_new], arg_x[any_new]] = new_keys.argmax(axis=1)[any_new]
+                self.keys_held_at_wait[group] = keys_held_at_wait
+                self.waiting_for_key[group] = ~any_new
+                waiting = selected.copy()
+                waiting[selected] = ~any_new
+                next_pc[waiting] = pc[waiting]
+            elif kk_value == 0x15:
+                self.delay_timer[group] = reg_v[group, arg_x]
+            elif kk_value == 0x18:
+                self.sound_timer[group] = reg_v[group, arg_x]
+            elif kk_value == 0x1E:
+                self.reg_i[group] += reg_v[group, arg_x]
+            elif kk_value == 0x29:
+                self.reg_i[group] = arg_x * 5  # Uses x itself, like vm.Chip8
+            elif kk_value == 0x33:
+                out_of_bounds = reg_i + 2 >= MEMORY_SIZE
+                self._crash(group[out_of_bounds], 'Memory write out of bounds.')
+                (group, arg_x, reg_i) = (group[~out_of_bounds], arg_x[~out_of_bounds], reg_i[~out_of_bounds])
+                value = reg_v[group, arg_x]
+                self.memory[group, reg_i] = value // 100
+                self.memory[group, reg_i + 1] = (value % 100) // 10
+                self.memory[group, reg_i + 2] = value % 10
+            elif kk_value == 0x55:
+                out_of_bounds = reg_i + arg_x >= MEMORY_SIZE
+                self._crash(group[out_of_bounds], 'Memory write out of bounds.')
+                (group, arg_x, reg_i) = (group[~out_of_bounds], arg_x[~out_of_bounds], reg_i[~out_of_bounds])
+                for register_number in range(16):
+                    storing = arg_x >= register_number
+                    self.memory[group[storing], reg_i[storing] + register_number] = reg_v[group[storing], register_number]
+            elif kk_value == 0x65:
+                out_of_bounds = reg_i + arg_x >= MEMORY_SIZE
+                self._crash(group[out_of_bounds], 'Memory read out of bounds.')
+                (group, arg_x, reg_i) = (group[~out_of_bounds], arg_x[~out_of_bounds], reg_i[~out_of_bounds])
+                for register_number in range(16):
+                    loading = arg_x >= register_number
+                    reg_v[group[loading], register_number] = self.memory[group[loading], reg_i[loading] + register_number]
+            else:
+                self._crash(group, 'FxXX instruction not recognised.')
+
+        return next_pc
+
+
+def measure_separate_machines(program, n_machines, frames, instructions_per_frame):
+    '''Return the aggregate instructions per second of n separate vm.Chip8 instances, for comparison.'''
+    from vm import Chip8
+
+    machines = [Chip8(program) for _ in range(n_machines)]
+    for chip8 in machines:
+        chip8.skip_idle_loops = False  # VectorChip8 runs every instruction, and skipped ones would count as run
+    executed = 0
+
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        for chip8 in machines:
+            executed += chip8.run(instructions_per_frame)
+            chip8.tick_timers()
+
+    return executed / (time.perf_counter() - start_time)
+
+
+def parse_arguments():
+    '''Parse the command line arguments.'''
+    parser = ArgumentParser(description='Run many copies of a Chip-8 ROM in lockstep and report the throughput.')
+    parser.add_argument('rom', help='Chip-8 ROM file to run')
+    parser.add_argument('--machines', type=int, default=1000, help='how many machines to run (default 1000)')
+    parser.add_argument('--frames', type=int, default=60, help='frames to run (default 60)')
+    parser.add_argument('--clock', type=int, default=DEFAULT_CLOCK_SPEED,
+                        help=f'instructions per second (default { DEFAULT_CLOCK_SPEED })')
+    parser.add_argument('--seed', type=int, help='seed for the random number generator')
+    parser.add_argument('--compare', action='store_true', help='also measure the same number of separate machines')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGUMENTS = parse_arguments()
+    with open(ARGUMENTS.rom, 'rb') as ROM_FILE:
+        PROGRAM = ROM_FILE.read()
+    INSTRUCTIONS_PER_FRAME = max(1, round(ARGUMENTS.clock / FRAME_RATE))
+
+    MACHINES = VectorChip8(PROGRAM, ARGUMENTS.machines, seed=ARGUMENTS.seed)
+    EXECUTED = 0
+    START_TIME = time.perf_counter()
+    for _ in range(ARGUMENTS.frames):
+        EXECUTED += MACHINES.run_frame(INSTRUCTIONS_PER_FRAME)
+    ELAPSED_TIME = time.perf_counter() - START_TIME
+
+    print(f'{ ARGUMENTS.machines } vectorized machines: { EXECUTED / ELAPSED_TIME:.0f} instructions/s '
+          f'({ int(MACHINES.crashed.sum()) } crashed)')
+
+    if ARGUMENTS.compare:
+        SEPARATE_SPEED = measure_separate_machines(PROGRAM, ARGUMENTS.machines, ARGUMENTS.frames, INSTRUCTIONS_PER_FRAME)
+        print(f'{ ARGUMENTS.machines } separate machines: { SEPARATE_SPEED:.0f} instructions/s')
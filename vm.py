@@ -1,9 +1,43 @@
 #!/usr/bin/env python3
 '''This module contains the Chip-8 class and its opcodes.'''
 
-from random import randint
-from memorybuffer import MemoryBuffer
-from timer import Timer
+from functools import partial
+from random import Random
+from framebuffer import FrameBuffer
+from headless import HeadlessIOManager
+from keypad import Keypad, KEY_COUNT
+from memorybuffer import MemoryBuffer, MEMORY_SIZE
+from timer import Timer, ThreadedTimer
+
+
+ENGINES = ('interpreter', 'translator')
+
+
+class UnknownInstructionError(Exception):
+    '''Raised when decoding an instruction that isn't part of the Chip-8 instruction set.'''
+
+
+class ExecutionHalted(Exception):
+    '''Raised by an instruction to end the current run early, with the PC left on that instruction.'''
+
+
+class IdleLoop(Exception):
+    '''Raised by the jump closing an idle loop, so that the rest of the loop's iterations in the current run are skipped.
+
+    Parameters:
+    instructions: instructions executed by a single iteration of the loop
+    reg_v: registers as they are after any number of whole iterations
+
+    '''
+    def __init__(self, instructions, reg_v):
+        super().__init__()
+        self.instructions = instructions
+        self.reg_v = reg_v
+
+
+def nnn_format(arg):
+    '''Keep a 12-bit function argument as a single address argument.'''
+    return (arg,)
 
 
 def nnn_format_to_xkk(arg):
@@ -23,6 +57,14 @@ def nnn_format_to_xyn(arg):
     return (arg_x, arg_y, arg_n)
 
 
+def nnn_format_to_xy(arg):
+    '''Separate a 12-bit function argument into two 4-bit arguments, ignoring the last nibble.'''
+    arg_x = (arg & 0xF00) >> 8
+    arg_y = (arg & 0x0F0) >> 4
+
+    return (arg_x, arg_y)
+
+
 def nnn_to_bcd(arg):
     '''Take a 12-bit argument and separate its decimal representation into its hundreds, tens and ones digits.'''
     hundreds_digit = arg // 100
@@ -32,17 +74,104 @@ def nnn_to_bcd(arg):
     return (hundreds_digit, tens_digit, ones_digit)
 
 
+def find_idle_loop(memory, addr):
+    '''
+    If the instruction at addr is a backward jump closing a loop that only reads the delay timer, loads constants
+    and ends in a skip over the jump, return (loop start, loop body bytes, register loads, skip), otherwise None.
+    Register loads are (x, kk) pairs, with None as kk for Fx07, and the skip is (category, x, y, kk) or None.
+    '''
+    instruction = memory.read_word_from_addr(addr)
+    start = instruction & 0x0FFF
+    if instruction >> 12 != 0x1 or start > addr or (addr - start) % 2:
+        return None
+
+    loads = []
+    skip = None
+    for body_addr in range(start, addr, 2):
+        body_instruction = memory.read_word_from_addr(body_addr)
+        instruction_category = body_instruction >> 12
+        (arg_x, arg_y, _) = nnn_format_to_xyn(body_instruction & 0x0FFF)
+        arg_kk = body_instruction & 0x00FF
+
+        if instruction_category == 0xF and arg_kk == 0x07:
+            loads.append((arg_x, None))
+        elif instruction_category == 0x6:
+            loads.append((arg_x, arg_kk))
+        elif instruction_category in (0x3, 0x4, 0x5, 0x9) and body_addr == addr - 2:
+            skip = (instruction_category, arg_x, arg_y, arg_kk)
+        else:
+            return None  # Anything else could have side effects, or leave the loop some other way
+
+    return (start, bytes(memory.read_data_from_addr(start, addr - start)), loads, skip)
+
+
+def _skip_taken(skip, reg_v):
+    '''Return True if a (category, x, y, kk) skip instruction skips, given the registers.'''
+    (instruction_category, arg_x, arg_y, arg_kk) = skip
+
+    if instruction_category == 0x3:
+        return reg_v[arg_x] == arg_kk
+    elif instruction_category == 0x4:
+        return reg_v[arg_x] != arg_kk
+    elif instruction_category == 0x5:
+        return reg_v[arg_x] == reg_v[arg_y]
+    else:
+        return arg_x != arg_y  # Mirrors _instruction_9, which compares the register numbers themselves
+
+
+def install_step_hook(chip8, hook):
+    '''
+    Make every engine run through hook._step one instruction at a time, as the Profiler and the Debugger do.
+    Engines that replace run, such as the translator, are set aside until the hook is removed, so that Chip8.run
+    goes through the hook. The step function installed before, possibly another hook's, becomes hook._next_step.
+    '''
+    hook._replaced_run = chip8.__dict__.pop('run', None)
+    hook._replaced_step = chip8.__dict__.get('step')
+    hook._next_step = chip8.step
+    chip8.step = hook._step
+
+
+def remove_step_hook(chip8, hook):
+    '''Undo install_step_hook, even if other hooks have been installed on top of this one since.'''
+    if chip8.__dict__.get('step') == hook._step:
+        if hook._replaced_step is None:
+            del chip8.step
+        else:
+            chip8.step = hook._replaced_step
+        if hook._replaced_run is not None:
+            chip8.run = hook._replaced_run
+        return
+
+    # Unlink the hook, handing what it replaced to the hook installed right on top of it
+    upper_hook = chip8.step.__self__
+    while upper_hook._next_step != hook._step:
+        upper_hook = upper_hook._next_step.__self__
+    upper_hook._next_step = hook._next_step
+    upper_hook._replaced_step = hook._replaced_step
+    if upper_hook._replaced_run is None:
+        upper_hook._replaced_run = hook._replaced_run
+
+
 class Chip8:
     '''Emulated Chip-8 machine.
 
     Parameters:
-    program: Chip-8 binary in binary string format
+    program: Chip-8 binary as a bytes-like object
+    engine: 'interpreter' to run one instruction at a time, 'translator' to run compiled basic blocks
+    threaded_timers: if True, the timers count down in their own threads instead of on every tick_timers call
+    seed: seed for the machine's random number generator, or None to seed it from the system
 
     '''
-    def __init__(self, program):
+    def __init__(self, program, engine='interpreter', threaded_timers=False, seed=None):
         # Memory buffer
         self.memory = MemoryBuffer(program)
 
+        # Display
+        self.display = FrameBuffer()
+
+        # Random number generator, so that the machine can be saved and restored as a whole
+        self.random = Random(seed)
+
         # Registers
         self.reg_v = [0] * 16
         self.reg_i = 0
@@ -52,44 +181,156 @@ class Chip8:
         self.reg_sp = 0
 
         # Timers
-        self.delay_timer = Timer()
-        self.sound_timer = Timer()
-        self.delay_timer.start()
-        self.sound_timer.start()
+        if threaded_timers:
+            self.delay_timer = ThreadedTimer()
+            self.sound_timer = ThreadedTimer()
+            self.delay_timer.start()
+            self.sound_timer.start()
+        else:
+            self.delay_timer = Timer()
+            self.sound_timer = Timer()
 
         # Stack
         self.stack = [0] * 16
 
-        # Opcode categories
+        # Idle loops can only be skipped when the delay timer doesn't change in the middle of a run
+        self.skip_idle_loops = not threaded_timers
+        self.skipped = 0  # Instructions counted by run without being executed, as skipped idle loop iterations
+
+        # Keypad, fed by the IOManager once per frame
+        self.keypad = Keypad()
+        self.waiting_for_key = False  # Halted on Fx0A until a key goes down
+        self._keys_held_at_wait = set()  # Keys already held when Fx0A started waiting, which can't end the wait
+        self.paused = False  # Set by the debugger, to have the scheduler skip frames
+
+        # Decoded instruction cache, indexed by address
+        self._decoded = [None] * MEMORY_SIZE
+        self.memory.add_write_listener(self._invalidate_decoded)
+        self.memory.add_restore_listener(self._invalidate_decoded)
+
+        # Opcode categories, along with the way their 12-bit argument is split
         self._instruction_lookup = [
-            self._instruction_0,
-            self._instruction_1,
-            self._instruction_2,
-            self._instruction_3,
-            self._instruction_4,
-            self._instruction_5,
-            self._instruction_6,
-            self._instruction_7,
-            self._instruction_8,
-            self._instruction_9,
-            self._instruction_A,
-            self._instruction_B,
-            self._instruction_C,
-            self._instruction_D,
-            self._instruction_E,
-            self._instruction_F
+            (self._decode_0, None),
+            (self._instruction_1, nnn_format),
+            (self._instruction_2, nnn_format),
+            (self._instruction_3, nnn_format_to_xkk),
+            (self._instruction_4, nnn_format_to_xkk),
+            (self._instruction_5, nnn_format_to_xy),
+            (self._instruction_6, nnn_format_to_xkk),
+            (self._instruction_7, nnn_format_to_xkk),
+            (self._decode_8, None),
+            (self._instruction_9, nnn_format_to_xy),
+            (self._instruction_A, nnn_format),
+            (self._instruction_B, nnn_format),
+            (self._instruction_C, nnn_format_to_xkk),
+            (self._instruction_D, nnn_format_to_xyn),
+            (self._decode_E, None),
+            (self._decode_F, None)
         ]
+        self._instruction_8_lookup = {
+            0x0: self._instruction_8xy0,
+            0x1: self._instruction_8xy1,
+            0x2: self._instruction_8xy2,
+            0x3: self._instruction_8xy3,
+            0x4: self._instruction_8xy4,
+            0x5: self._instruction_8xy5,
+            0x6: self._instruction_8xy6,
+            0x7: self._instruction_8xy7,
+            0xE: self._instruction_8xyE
+        }
+        self._instruction_F_lookup = {
+            0x07: self._instruction_Fx07,
+            0x0A: self._instruction_Fx0A,
+            0x15: self._instruction_Fx15,
+            0x18: self._instruction_Fx18,
+            0x1E: self._instruction_Fx1E,
+            0x29: self._instruction_Fx29,
+            0x33: self._instruction_Fx33,
+            0x55: self._instruction_Fx55,
+            0x65: self._instruction_Fx65
+        }
+
+        # Execution engine
+        if engine not in ENGINES:
+            raise Exception(f'Unknown execution engine { engine }.')
+        self.engine = engine
+        if engine == 'translator':
+            from translator import BlockTranslator  # Imported here because it depends on this module
+            self.run = BlockTranslator(self).run
+
+        # Input/output, until a different IOManager is attached to this machine
+        HeadlessIOManager(self)
 
     def set_io_manager(self, io_manager):
-        '''Set the given IOManager as a class attribute. Hack.'''
+        '''Set the given IOManager as the one serving this machine.'''
         self.io_manager = io_manager
 
     def step(self):
         '''Emulate the execution of a Chip-8 program.'''
-        to_execute = self.memory.read_word_from_addr(self.reg_pc)
-        self._execute_instruction(to_execute)
+        handler = self._decoded[self.reg_pc]
+        if handler is None:
+            handler = self._decode(self.reg_pc)
+        handler()
+
+        self.reg_pc += 2  # Instructions are 2 bytes long
+
+    def run(self, cycles):
+        '''
+        Execute up to the given number of instructions, stopping early if the CPU halts, and return how many were
+        executed. Skipped idle loop iterations count as executed, and are also added to self.skipped.
+        '''
+        step = self.step
+        executed = 0
+        try:
+            for executed in range(cycles):
+                step()
+        except ExecutionHalted:
+            return executed
+        except IdleLoop as idle_loop:
+            executed += 1 + self.skip_idle_iterations(idle_loop, cycles - executed - 1)
+            # What's left is shorter than an iteration, so it never reaches the jump again,
+            # but it can still halt, for instance on a debugger breakpoint
+            try:
+                for remaining in range(cycles - executed):
+                    step()
+            except ExecutionHalted:
+                return executed + remaining
+
+        return cycles
+
+    def skip_idle_iterations(self, idle_loop, cycles):
+        '''
+        Skip as many whole iterations of an idle loop as fit in the given number of instructions, and return how many
+        instructions that is. They are also added to self.skipped, since run counts them as executed.
+        '''
+        iterations = cycles // idle_loop.instructions
+        if iterations:
+            self.reg_v[:] = idle_loop.reg_v
+
+        skipped = iterations * idle_loop.instructions
+        self.skipped += skipped
+        return skipped
+
+    def is_halted(self):
+        '''Returns True if the CPU is waiting on Fx0A and no key went down since it started waiting.'''
+        return self.waiting_for_key and self._new_key_pressed() is None
 
-        self._move_to_next_instruction()
+    def _new_key_pressed(self):
+        '''Return the lowest key held that wasn't already held when Fx0A started waiting, or None.'''
+        keypad = self.keypad
+        # A key released since then counts as new the next time it goes down
+        self._keys_held_at_wait = {key for key in self._keys_held_at_wait if keypad.is_pressed(key)}
+
+        for key in range(KEY_COUNT):
+            if keypad.is_pressed(key) and key not in self._keys_held_at_wait:
+                return key
+
+        return None
+
+    def tick_timers(self):
+        '''Count the timers down, called once per emulated frame.'''
+        self.delay_timer.tick()
+        self.sound_timer.tick()
 
     def push_to_stack(self, value):
         '''Push a value to the stack.'''
@@ -107,30 +348,80 @@ class Chip8:
         self.reg_sp -= 1
         return self.stack[self.reg_sp]
 
-    # Opcode implementations
-    def _execute_instruction(self, instruction):
+    # Instruction decoding
+    def _decode(self, addr):
+        '''Decode the instruction stored at addr and cache the result.'''
+        handler = self.decode_instruction(self.memory.read_word_from_addr(addr))
+        if self.skip_idle_loops:
+            idle_loop = find_idle_loop(self.memory, addr)
+            if idle_loop is not None:
+                handler = partial(self._instruction_1_idle, *idle_loop)
+        self._decoded[addr] = handler
+
+        return handler
+
+    def _invalidate_decoded(self, addr, n_bytes):
+        '''Forget decoded instructions overlapping the n bytes written at addr.'''
+        # An instruction starting one byte before addr also has its second byte overwritten
+        for invalidated_addr in range(max(addr - 1, 0), addr + n_bytes):
+            self._decoded[invalidated_addr] = None
+
+    def decode_instruction(self, instruction):
         '''
-        Given the instruction xyzw, call the function _instruction_x with yzw as an argument.
-        Serves as a way to call a search tree.
+        Given the instruction xyzw, return the function _instruction_x with yzw already split into its operands.
+        The returned handler takes no arguments.
         '''
-        instruction_int = int(instruction, 16)
-        instruction_category = (instruction_int & 0xF000) >> 12
-        instruction_argument = instruction_int & 0x0FFF
+        instruction_category = (instruction & 0xF000) >> 12
+        instruction_argument = instruction & 0x0FFF
+
+        (handler, argument_format) = self._instruction_lookup[instruction_category]
+        if argument_format is None:
+            return handler(instruction_argument)  # Redirects decode the rest of the instruction themselves
 
-        self._instruction_lookup[instruction_category](instruction_argument)
+        return partial(handler, *argument_format(instruction_argument))
 
-    def _instruction_0(self, arg):
+    def _decode_0(self, arg):
         '''Redirect to 0nnn [SYS addr], 00E0 [CLS] or 00EE [RET].'''
         if arg == 0x00E0:
-            self._instruction_00E0()
+            return self._instruction_00E0
         elif arg == 0x00EE:
-            self._instruction_00EE()
+            return self._instruction_00EE
         else:
-            self._instruction_0nnn(arg)
+            return partial(self._instruction_0nnn, arg)
+
+    def _decode_8(self, arg):
+        '''Redirect to 8xy[0-7] and 8xyE.'''
+        (arg_x, arg_y, arg_n) = nnn_format_to_xyn(arg)
+
+        if arg_n not in self._instruction_8_lookup:
+            raise UnknownInstructionError('8xyX instruction not recognised.')
+
+        return partial(self._instruction_8_lookup[arg_n], arg_x, arg_y)
 
+    def _decode_E(self, arg):
+        '''Redirect to either [SKP Vx] or [SKNP Vx].'''
+        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
+
+        if arg_kk == 0x9E:
+            return partial(self._instruction_Ex9E, arg_x)
+        elif arg_kk == 0xA1:
+            return partial(self._instruction_ExA1, arg_x)
+        else:
+            raise UnknownInstructionError('ExXX instruction not recognised.')
+
+    def _decode_F(self, arg):
+        '''Redirect to all instructions starting with the F nibble.'''
+        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
+
+        if arg_kk not in self._instruction_F_lookup:
+            raise UnknownInstructionError('FxXX instruction not recognised.')
+
+        return partial(self._instruction_F_lookup[arg_kk], arg_x)
+
+    # Opcode implementations
     def _instruction_00E0(self):
         '''Instruction 00E0 [CLS].'''
-        self.io_manager.clear_screen()
+        self.display.clear()
 
     def _instruction_00EE(self):
         '''Instruction 00EE [RET].'''
@@ -145,38 +436,50 @@ class Chip8:
         '''Instruction 1nnn [JP addr].'''
         self.reg_pc = addr - 2  # Hack, so that at the end of the CPU cycle it points to the intended place
 
+    def _instruction_1_idle(self, start, body, loads, skip):
+        '''Instruction 1nnn [JP addr] closing an idle loop, found by find_idle_loop.'''
+        # The loop body is only checked here, since writing to it doesn't forget this decoded jump
+        if self.memory.read_data_from_addr(start, len(body)) == body:
+            # Run one more iteration on a copy of the registers, and if it comes back here so does every later one,
+            # until the delay timer changes at the end of the frame
+            reg_v = self.reg_v.copy()
+            delay_timer_value = self.delay_timer.get_value()
+            for (arg_x, arg_kk) in loads:
+                reg_v[arg_x] = delay_timer_value if arg_kk is None else arg_kk
+
+            if skip is None or not _skip_taken(skip, reg_v):
+                self.reg_pc = start
+                raise IdleLoop(len(body) // 2 + 1, reg_v)
+
+        self.reg_pc = start - 2  # Same hack as _instruction_1
+
     def _instruction_2(self, addr):
         '''Instruction 2nnn [CALL addr].'''
         self.push_to_stack(self.reg_pc)
         self.reg_pc = addr
 
-    def _instruction_3(self, arg):
+    def _instruction_3(self, arg_x, arg_kk):
         '''Instruction 3xkk [SE Vx, byte].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
         if self.reg_v[arg_x] == arg_kk:
             self._move_to_next_instruction()
 
-    def _instruction_4(self, arg):
+    def _instruction_4(self, arg_x, arg_kk):
         '''Instruction 4xkk [SNE Vx, byte].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
         if self.reg_v[arg_x] != arg_kk:
             self._move_to_next_instruction()
 
-    def _instruction_5(self, arg):
+    def _instruction_5(self, arg_x, arg_y):
         '''Instruction 5xy0 [SE Vx, Vy].'''
         # Last nibble is not checked to be zero for now, will change if needed
-        (arg_x, arg_y, _) = nnn_format_to_xyn(arg)
         if self.reg_v[arg_x] == self.reg_v[arg_y]:
             self._move_to_next_instruction()
 
-    def _instruction_6(self, arg):
+    def _instruction_6(self, arg_x, arg_kk):
         '''Instruction 6xkk [LD Vx, byte].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
         self.reg_v[arg_x] = arg_kk
 
-    def _instruction_7(self, arg):
+    def _instruction_7(self, arg_x, arg_kk):
         '''Instruction 7xkk [ADD Vx, byte].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
         self.reg_v[arg_x] += arg_kk
 
         if self.reg_v[arg_x] >= 256:
@@ -185,23 +488,6 @@ class Chip8:
         else:
             self.reg_v[0xF] = 0
 
-    def _instruction_8(self, arg):
-        '''Redirect to 8xy[0-7] and 8xyE.'''
-        functions = {
-            0x0: self._instruction_8xy0,
-            0x1: self._instruction_8xy1,
-            0x2: self._instruction_8xy2,
-            0x3: self._instruction_8xy3,
-            0x4: self._instruction_8xy4,
-            0x5: self._instruction_8xy5,
-            0x6: self._instruction_8xy6,
-            0x7: self._instruction_8xy7,
-            0xE: self._instruction_8xyE
-        }
-
-        (arg_x, arg_y, arg_n) = nnn_format_to_xyn(arg)
-        functions[arg_n](arg_x, arg_y)
-
     def _instruction_8xy0(self, arg_x, arg_y):
         '''Instruction 8xy0 [LD Vx, Vy].'''
         self.reg_v[arg_x] = self.reg_v[arg_y]
@@ -257,7 +543,7 @@ class Chip8:
         else:
             self.reg_v[0xF] = 0
 
-        self.reg_v[arg_x] = self.reg_v[arg_y] - self.reg_v[arg_x]
+        self.reg_v[arg_x] = (self.reg_v[arg_y] - self.reg_v[arg_x]) % 256
 
     def _instruction_8xyE(self, arg_x, arg_y):
         '''Instruction 8xyE [SHL Vx {, Vy}].'''
@@ -267,86 +553,58 @@ class Chip8:
         else:
             self.reg_v[0xF] = 0
 
-        self.reg_v[arg_x] = self.reg_v[arg_y] << 1
+        self.reg_v[arg_x] = (self.reg_v[arg_y] << 1) & 0xFF
 
-    def _instruction_9(self, arg):
+    def _instruction_9(self, arg_x, arg_y):
         '''Instruction 9xy0 [SNE Vx, Vy].'''
-        (arg_x, arg_y, _) = nnn_format_to_xyn(arg)
-
         if arg_x != arg_y:
             self._move_to_next_instruction()
 
-    def _instruction_A(self, arg):
+    def _instruction_A(self, addr):
         '''Instruction Annn [LD I, addr].'''
-        self.reg_i = arg
+        self.reg_i = addr
 
-    def _instruction_B(self, arg):
+    def _instruction_B(self, addr):
         '''Instruction Bnnn [JP V0, addr].'''
-        self.reg_pc = self.reg_v[0] + arg
+        self.reg_pc = self.reg_v[0] + addr
 
-    def _instruction_C(self, arg):
+    def _instruction_C(self, arg_x, arg_kk):
         '''Instruction Cxkk [RND Vx, byte].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
-        self.reg_v[arg_x] = randint(0, 255) & arg_kk
+        self.reg_v[arg_x] = self.random.randint(0, 255) & arg_kk
 
-    def _instruction_D(self, arg):
+    def _instruction_D(self, arg_x, arg_y, arg_n):
         '''Instruction Dxyn [DRW Vx, Vy, nibble].'''
-        (arg_x, arg_y, arg_n) = nnn_format_to_xyn(arg)
-
-        self.reg_v[0xF] = 0  # Reset the flag register to its default value
-
-        for row_number in range(arg_n):
-            sprite = self.memory.read_byte_from_addr(self.reg_i + row_number)
-            if self.io_manager.check_collission(sprite, self.reg_v[arg_x], self.reg_v[arg_y]):
-                self.reg_v[0xF] = 1
-            self.io_manager.draw_sprite(sprite, self.reg_v[arg_x], self.reg_v[arg_y] + row_number)
-
-    def _instruction_E(self, arg):
-        '''Redirect to either [SKP Vx] or [SKNP Vx].'''
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
-
-        if arg_kk == 0x9E:
-            self._instruction_Ex9E(arg_x)
-        elif arg_kk == 0xA1:
-            self._instruction_ExA1(arg_x)
-        else:
-            raise Exception('ExXX instruction not recognised.')
+        sprite = self.memory.read_data_from_addr(self.reg_i, arg_n)
+        self.reg_v[0xF] = self.display.draw_sprite(sprite, self.reg_v[arg_x], self.reg_v[arg_y])
 
     def _instruction_Ex9E(self, arg_x):
         '''Instruction Ex9E [SKP Vx].'''
-        if self.io_manager.is_key_pressed(self.reg_v[arg_x]):
+        if self.keypad.is_pressed(self.reg_v[arg_x]):
             self._move_to_next_instruction()
 
     def _instruction_ExA1(self, arg_x):
         '''Instruction ExA1 [SKNP Vx].'''
-        if not self.io_manager.is_key_pressed(self.reg_v[arg_x]):
+        if not self.keypad.is_pressed(self.reg_v[arg_x]):
             self._move_to_next_instruction()
 
-    def _instruction_F(self, arg):
-        '''Redirect to all instructions starting with the F nibble.'''
-        functions = {
-            0x07: self._instruction_Fx07,
-            0x0A: self._instruction_Fx0A,
-            0x15: self._instruction_Fx15,
-            0x18: self._instruction_Fx18,
-            0x1E: self._instruction_Fx1E,
-            0x29: self._instruction_Fx29,
-            0x33: self._instruction_Fx33,
-            0x55: self._instruction_Fx55,
-            0x65: self._instruction_Fx65
-        }
-
-        (arg_x, arg_kk) = nnn_format_to_xkk(arg)
-
-        functions[arg_kk](arg_x)
-
     def _instruction_Fx07(self, arg_x):
         '''Instruction Fx07 [LD Vx, DT].'''
         self.reg_v[arg_x] = self.delay_timer.get_value()
 
     def _instruction_Fx0A(self, arg_x):
         '''Instruction Fx0A [LD Vx, K].'''
-        self.reg_v[arg_x] = self.io_manager.wait_for_input()
+        # Like the original wait for a key event, a key held from before, e.g. by the previous Fx0A, doesn't count
+        if not self.waiting_for_key:
+            self.waiting_for_key = True
+            self._keys_held_at_wait = {key for key in range(KEY_COUNT) if self.keypad.is_pressed(key)}
+
+        key = self._new_key_pressed()
+        if key is None:
+            # Raising skips the PC increment, so this instruction runs again once the CPU resumes
+            raise ExecutionHalted()
+
+        self.waiting_for_key = False
+        self.reg_v[arg_x] = key
 
     def _instruction_Fx15(self, arg_x):
         '''Instruction Fx15 [LD DT, Vx].'''
@@ -377,15 +635,14 @@ class Chip8:
 
     def _instruction_Fx55(self, arg_x):
         '''Instruction Fx55 [LD [I], Vx].'''
-        for register_number in range(arg_x + 1):
-            write_addr = self.reg_i + register_number
-            self.memory.write_byte_to_addr(self.reg_v[register_number], write_addr)
+        self.memory.write_data_to_addr(bytes(self.reg_v[:arg_x + 1]), self.reg_i)
 
     def _instruction_Fx65(self, arg_x):
         '''Instruction Fx65 [LD Vx, [I]].'''
-        for register_number in range(arg_x + 1):
-            read_addr = self.reg_i + register_number
-            self.reg_v[register_number] = int(self.memory.read_byte_from_addr(read_addr), 16)
+        # A short read would shrink the registers instead of failing
+        if self.reg_i + arg_x + 1 > MEMORY_SIZE:
+            raise IndexError('Memory read out of bounds.')
+        self.reg_v[:arg_x + 1] = self.memory.read_data_from_addr(self.reg_i, arg_x + 1)
 
     def _move_to_next_instruction(self):
         '''Increase the PC register to point to the next instruction.'''